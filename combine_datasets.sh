@@ -1,8 +1,44 @@
 #!/bin/bash
 
-# Create ultimate dataset directory
-rm -rf ultimate_punch_dataset
-mkdir ultimate_punch_dataset
+# Build into a temp directory and swap it in at the end, so an interrupted
+# run never leaves a half-combined dataset behind
+out=ultimate_punch_dataset.tmp
+rm -rf "$out"
+mkdir "$out"
+
+# Datasets whose last run never committed are marked "complete": false
+is_incomplete() {
+  grep -q '"complete": false' "$1/manifest.json" 2>/dev/null
+}
+
+# Images a dataset actually contains: the manifest's file list when there is
+# one (a re-run that wrote fewer images leaves old files behind), else *.jpg
+list_images() {
+  if [ -f "$1/manifest.json" ]; then
+    python3 -c 'import json, sys
+for f in json.load(open(sys.argv[1] + "/manifest.json")).get("files", []):
+    if f.endswith(".jpg"): print(sys.argv[1] + "/" + f)' "$1"
+  else
+    ls "$1"/*.jpg 2>/dev/null
+  fi
+}
+
+copy_dataset() {
+  if is_incomplete "$1"; then
+    echo "⚠️ Skipping incomplete dataset: $1"
+    return
+  fi
+  while IFS= read -r img; do
+    if [ -f "$img" ]; then
+      cp "$img" "$out/punch_$(printf '%03d' $counter).jpg"
+      txt="${img%.jpg}.txt"
+      if [ -f "$txt" ]; then
+        cp "$txt" "$out/punch_$(printf '%03d' $counter).txt"
+      fi
+      ((counter++))
+    fi
+  done < <(list_images "$1")
+}
 
 echo "Combining all punch datasets..."
 
@@ -10,33 +46,21 @@ echo "Combining all punch datasets..."
 counter=1
 
 # Copy from training_ready
-for img in training_ready/*.jpg; do
-  if [ -f "$img" ]; then
-    cp "$img" "ultimate_punch_dataset/punch_$(printf '%03d' $counter).jpg"
-    txt="${img%.jpg}.txt"
-    if [ -f "$txt" ]; then
-      cp "$txt" "ultimate_punch_dataset/punch_$(printf '%03d' $counter).txt"
-    fi
-    ((counter++))
-  fi
-done
+if [ -d training_ready ]; then
+  copy_dataset training_ready
+fi
 
 # Copy from each video folder
 for folder in punch_video_*; do
   if [ -d "$folder" ]; then
-    for img in "$folder"/*.jpg; do
-      if [ -f "$img" ]; then
-        cp "$img" "ultimate_punch_dataset/punch_$(printf '%03d' $counter).jpg"
-        txt="${img%.jpg}.txt"
-        if [ -f "$txt" ]; then
-          cp "$txt" "ultimate_punch_dataset/punch_$(printf '%03d' $counter).txt"
-        fi
-        ((counter++))
-      fi
-    done
+    copy_dataset "$folder"
   fi
 done
 
+sync
+rm -rf ultimate_punch_dataset
+mv "$out" ultimate_punch_dataset
+
 total=$(ls ultimate_punch_dataset/*.jpg 2>/dev/null | wc -l)
 echo "✅ Combined $total images into ultimate_punch_dataset/"
 echo "📁 Ready for upload: ultimate_punch_dataset/"
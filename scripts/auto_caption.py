@@ -62,8 +62,25 @@ class CombatCaptionGenerator:
             ]
         }
 
+    def pick_tags(self, tags: List[str], count: int, tag_counts: Dict[str, int] = None) -> List[str]:
+        """
+        Pick `count` tags - at random, or the least used ones when tag counts
+        are given (ties broken at random). Picked tags are counted in place so
+        a whole directory run stays balanced.
+        """
+        import random
+        
+        if tag_counts is None:
+            return random.sample(tags, count)
+        
+        ranked = sorted(tags, key=lambda t: (tag_counts.get(t, 0), random.random()))
+        selected = ranked[:count]
+        for tag in selected:
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        return selected
+
     def generate_caption(self, combat_type: str, image_name: str, 
-                        custom_tags: List[str] = None) -> Dict:
+                        custom_tags: List[str] = None, tag_counts: Dict[str, int] = None) -> Dict:
         """Generate a complete caption for an image"""
         
         template = self.caption_templates.get(combat_type, self.caption_templates['punching'])
@@ -77,15 +94,14 @@ class CombatCaptionGenerator:
         # Add base tags
         caption_parts.extend(template['base_tags'])
         
-        # Add specific tags (randomly select some for variety)
-        import random
+        # Add specific tags (under-represented first when counts are known)
         num_specific = min(4, len(template['specific_tags']))
-        selected_specific = random.sample(template['specific_tags'], num_specific)
+        selected_specific = self.pick_tags(template['specific_tags'], num_specific, tag_counts)
         caption_parts.extend(selected_specific)
         
         # Add style tags
         num_style = min(2, len(template['style_tags']))
-        selected_style = random.sample(template['style_tags'], num_style)
+        selected_style = self.pick_tags(template['style_tags'], num_style, tag_counts)
         caption_parts.extend(selected_style)
         
         # Add custom tags if provided
@@ -104,8 +120,24 @@ class CombatCaptionGenerator:
             'trigger_word': template['trigger_word']
         }
 
-    def auto_caption_directory(self, directory: str, combat_type: str):
-        """Auto-caption all images in a directory"""
+    def auto_caption_directory(self, directory: str, combat_type: str, tag_counts: Dict[str, int] = None,
+                               write_config: bool = False):
+        """
+        Auto-caption all images in a directory
+        
+        Tags are balanced against tag_counts (e.g. loaded from a tag_counts.json
+        exported by caption_index.py) or, failing that, against this run alone.
+        With write_config the training config is published in the same commit.
+        """
+        from dataset_writer import DatasetWriter
+        
+        if tag_counts is None:
+            counts_file = os.path.join(directory, 'tag_counts.json')
+            if os.path.exists(counts_file):
+                with open(counts_file) as f:
+                    tag_counts = json.load(f)
+            else:
+                tag_counts = {}
         
         captions = []
         caption_file = os.path.join(directory, 'captions.json')
@@ -117,28 +149,59 @@ class CombatCaptionGenerator:
         
         print(f"Found {len(images)} images to caption")
         
-        for img in images:
-            # Generate caption
-            caption_data = self.generate_caption(combat_type, img)
-            captions.append(caption_data)
+        # Captions are staged and published atomically; the dataset only
+        # counts as complete once every image has its caption
+        with DatasetWriter(directory) as writer:
+            # Files and metadata from bulk / video prep stay in the manifest
+            writer.keep_previous()
+            for img in images:
+                # Generate caption
+                caption_data = self.generate_caption(combat_type, img, tag_counts=tag_counts)
+                captions.append(caption_data)
+                
+                # Also create individual text files (some trainers need this)
+                txt_filename = os.path.splitext(img)[0] + '.txt'
+                writer.write_text(txt_filename, caption_data['caption'])
+                writer.include(img)
+                
+                print(f"Captioned: {img}")
             
-            # Also create individual text files (some trainers need this)
-            txt_filename = os.path.splitext(img)[0] + '.txt'
-            txt_path = os.path.join(directory, txt_filename)
-            with open(txt_path, 'w') as f:
-                f.write(caption_data['caption'])
-            
-            print(f"Captioned: {img}")
-        
-        # Save all captions to JSON
-        with open(caption_file, 'w') as f:
-            json.dump(captions, f, indent=2)
+            # Save all captions to JSON
+            writer.write_json('captions.json', captions)
+            if write_config:
+                self.create_training_config(directory, combat_type, writer=writer)
+            writer.commit({
+                'images_count': len(images),
+                'combat_type': combat_type,
+                'trigger_word': self.caption_templates[combat_type]['trigger_word']
+            })
         
         print(f"\n✅ Saved {len(captions)} captions to {caption_file}")
         return captions
 
-    def create_training_config(self, directory: str, combat_type: str):
-        """Create a complete training configuration file"""
+    def create_training_config(self, directory: str, combat_type: str, writer=None):
+        """
+        Create a complete training configuration file
+        
+        Pass the run's DatasetWriter to publish it with that run's commit;
+        otherwise it is committed on its own, keeping the existing manifest.
+        """
+        from dataset_profiler import profile_dataset, recommend_settings, print_profile
+        from dataset_writer import DatasetWriter
+        
+        if writer is None:
+            with DatasetWriter(directory) as writer:
+                writer.keep_previous()
+                config = self.create_training_config(directory, combat_type, writer)
+                writer.commit()
+            return config
+        
+        writer.flush()  # Profile sees the captions published so far
+        
+        # Size steps / rank / learning rate to the dataset instead of fixed defaults
+        profile = profile_dataset(directory)
+        recommended = recommend_settings(profile)
+        print_profile(profile, recommended)
         
         config = {
             'dataset_path': directory,
@@ -146,13 +209,14 @@ class CombatCaptionGenerator:
             'trigger_word': self.caption_templates[combat_type]['trigger_word'],
             'training_settings': {
                 'base_model': 'WAN 2.2',
-                'steps': 1000,
-                'learning_rate': 0.0004,
+                'steps': recommended['steps'],
+                'learning_rate': recommended['learning_rate'],
                 'batch_size': 1,
-                'network_dim': 16,
-                'network_alpha': 8,
-                'resolution': 1024
+                'network_dim': recommended['network_dim'],
+                'network_alpha': recommended['network_dim'] // 2,
+                'resolution': recommended['resolution']
             },
+            'dataset_profile': profile,
             'augmentation': {
                 'random_flip': True,
                 'color_jitter': 0.1,
@@ -162,8 +226,7 @@ class CombatCaptionGenerator:
         }
         
         config_path = os.path.join(directory, 'training_config.json')
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        writer.write_json('training_config.json', config)
         
         print(f"✅ Saved training config to {config_path}")
         return config
@@ -248,5 +311,4 @@ if __name__ == "__main__":
     # Auto-caption a directory of punching images
     image_dir = os.path.expanduser('~/combat-lora-maker/training_data/punching')
     if os.path.exists(image_dir):
-        captioner.auto_caption_directory(image_dir, 'punching')
-        captioner.create_training_config(image_dir, 'punching')
+        captioner.auto_caption_directory(image_dir, 'punching', write_config=True)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Caption Index - Inverted tag index over every dataset's captions
+
+Each tag maps to a bitmap of image ids (a Python int, bit n = image n), so
+"how many images are tagged uppercut" is a popcount and tag combinations
+are bitwise AND / OR / NOT. The index is rebuilt incrementally: only caption
+files whose size or mtime changed are re-read.
+
+    python caption_index.py build ~/combat-lora-maker
+    python caption_index.py query uppercut jab --not hook
+    python caption_index.py rebalance ~/combat-lora-maker/training_ready --max-share 0.5
+    python caption_index.py export --dataset ~/combat-lora-maker/training_ready
+"""
+
+import os
+import json
+import argparse
+from typing import Dict, List
+
+from dataset_writer import resolve_output_path
+
+DEFAULT_INDEX = resolve_output_path('caption_index.json')
+TAG_COUNTS_FILE = 'tag_counts.json'
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.bmp']
+EXCLUDED_DIR = '.excluded'
+MAX_DROP_SHARE = 0.5  # rebalance --apply refuses plans dropping more than this without --force
+SHARE_SLACK = 1.25    # Default cap: this much above the share a perfectly balanced set would have
+
+
+def parse_caption(text: str) -> List[str]:
+    """Caption text -> normalised, de-duplicated tags"""
+    tags = []
+    for tag in text.split(','):
+        tag = tag.strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def template_specific_tags() -> List[str]:
+    """Every auto_caption template's specific tags - the ones worth balancing"""
+    from auto_caption import CombatCaptionGenerator
+    templates = CombatCaptionGenerator().caption_templates.values()
+    return sorted({tag.lower() for template in templates for tag in template['specific_tags']})
+
+
+def bits_to_ids(bitmap: int) -> List[int]:
+    ids = []
+    while bitmap:
+        low = bitmap & -bitmap
+        ids.append(low.bit_length() - 1)
+        bitmap ^= low
+    return ids
+
+
+class CaptionIndex:
+    """Tag -> image-id bitmaps, persisted as JSON"""
+
+    def __init__(self, index_path: str = DEFAULT_INDEX):
+        self.index_path = os.path.expanduser(index_path)
+        self.paths: List[str] = []          # id -> image path ('' once removed)
+        self.sources: Dict[str, Dict] = {}  # image path -> {id, source, mtime, size, tags}
+        self.postings: Dict[str, int] = {}  # tag -> bitmap of ids
+        self.free_ids: List[int] = []
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                data = json.load(f)
+            self.paths = data['paths']
+            self.sources = data['sources']
+            self.postings = {tag: int(bits, 16) for tag, bits in data['postings'].items()}
+            self.free_ids = data.get('free_ids', [])
+
+    def save(self):
+        from dataset_writer import atomic_write_json
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        atomic_write_json(self.index_path, {
+            'version': 1,
+            'paths': self.paths,
+            'sources': self.sources,
+            'postings': {tag: format(bits, 'x') for tag, bits in self.postings.items() if bits},
+            'free_ids': self.free_ids
+        })
+
+    # -- maintenance --
+
+    def _remove(self, image_path: str):
+        entry = self.sources.pop(image_path)
+        mask = ~(1 << entry['id'])
+        for tag in entry['tags']:
+            self.postings[tag] = self.postings.get(tag, 0) & mask
+        self.paths[entry['id']] = ''
+        self.free_ids.append(entry['id'])
+
+    def _add(self, image_path: str, source: str, stat, tags: List[str]):
+        if self.free_ids:
+            image_id = self.free_ids.pop()
+            self.paths[image_id] = image_path
+        else:
+            image_id = len(self.paths)
+            self.paths.append(image_path)
+
+        bit = 1 << image_id
+        for tag in tags:
+            self.postings[tag] = self.postings.get(tag, 0) | bit
+        self.sources[image_path] = {
+            'id': image_id, 'source': source,
+            'mtime': stat.st_mtime, 'size': stat.st_size, 'tags': tags
+        }
+
+    def _scan(self, root: str) -> Dict[str, tuple]:
+        """image path -> (caption source, stat, caption text or None to read the .txt)"""
+        found = {}
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            images = {os.path.splitext(f)[0]: f for f in files
+                      if any(f.lower().endswith(ext) for ext in IMAGE_EXTENSIONS)}
+
+            # captions.json first - per-image .txt files override it below
+            if 'captions.json' in files:
+                source = os.path.join(dirpath, 'captions.json')
+                stat = os.stat(source)
+                try:
+                    with open(source) as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    entries = []
+                for entry in entries:
+                    if isinstance(entry, dict) and entry.get('image') in files:
+                        found[os.path.join(dirpath, entry['image'])] = (source, stat, entry.get('caption', ''))
+
+            for stem, image in images.items():
+                txt = stem + '.txt'
+                if txt in files:
+                    source = os.path.join(dirpath, txt)
+                    found[os.path.join(dirpath, image)] = (source, os.stat(source), None)
+        return found
+
+    def update(self, roots: List[str]) -> Dict[str, int]:
+        """Incrementally sync the index with caption files under roots"""
+        added = updated = removed = 0
+        roots = [os.path.abspath(os.path.expanduser(r)) for r in roots]
+
+        seen = set()
+        for root in roots:
+            for image_path, (source, stat, caption) in self._scan(root).items():
+                seen.add(image_path)
+                entry = self.sources.get(image_path)
+                if entry and entry['source'] == source and entry['mtime'] == stat.st_mtime \
+                        and entry['size'] == stat.st_size:
+                    continue
+
+                if caption is None:
+                    with open(source) as f:
+                        caption = f.read()
+                if entry:
+                    self._remove(image_path)
+                    updated += 1
+                else:
+                    added += 1
+                self._add(image_path, source, stat, parse_caption(caption))
+
+        # Forget images that disappeared from the scanned roots
+        for image_path in list(self.sources):
+            if image_path not in seen and any(image_path.startswith(r + os.sep) for r in roots):
+                self._remove(image_path)
+                removed += 1
+
+        return {'added': added, 'updated': updated, 'removed': removed, 'total': len(self.sources)}
+
+    # -- queries --
+
+    def dataset_bitmap(self, dataset: str = None) -> int:
+        """Bitmap of every image, or only those inside one dataset folder"""
+        prefix = os.path.abspath(os.path.expanduser(dataset)) + os.sep if dataset else None
+        bitmap = 0
+        for image_path, entry in self.sources.items():
+            if prefix is None or image_path.startswith(prefix):
+                bitmap |= 1 << entry['id']
+        return bitmap
+
+    def query(self, all_of: List[str], none_of: List[str] = (), dataset: str = None) -> int:
+        bitmap = self.dataset_bitmap(dataset)
+        for tag in all_of:
+            bitmap &= self.postings.get(tag.lower(), 0)
+        for tag in none_of:
+            bitmap &= ~self.postings.get(tag.lower(), 0)
+        return bitmap
+
+    def images(self, bitmap: int) -> List[str]:
+        return [self.paths[i] for i in bits_to_ids(bitmap)]
+
+    def tag_counts(self, dataset: str = None) -> Dict[str, int]:
+        scope = self.dataset_bitmap(dataset)
+        counts = {tag: (bits & scope).bit_count() for tag, bits in self.postings.items()}
+        return {tag: n for tag, n in sorted(counts.items(), key=lambda kv: -kv[1]) if n}
+
+    def capped_postings(self, dataset: str, tags: List[str] = None) -> List[int]:
+        """
+        Postings (within dataset) of the tags rebalance caps - `tags`, or by
+        default the auto_caption templates' specific tags, since style tags
+        come from a short list and can't be spread thin. Tags on every image
+        are left alone.
+        """
+        images = self.dataset_bitmap(dataset)
+        tags = [tag.strip().lower() for tag in tags] if tags else template_specific_tags()
+        postings = [self.postings[tag] & images for tag in tags if tag in self.postings]
+        return [bits for bits in postings if bits and bits != images]
+
+    def balanced_share(self, dataset: str, tags: List[str] = None) -> float:
+        """
+        Share each capped tag would have if tags were spread perfectly evenly:
+        tags per image / number of tags. Captions with 4 of 10 tags can't get
+        any tag below ~40% however many images are dropped.
+        """
+        postings = self.capped_postings(dataset, tags)
+        images = self.dataset_bitmap(dataset).bit_count()
+        if not postings or not images:
+            return 0.0
+        return sum(bits.bit_count() for bits in postings) / (len(postings) * images)
+
+    def rebalance_plan(self, dataset: str, max_share: float = None, tags: List[str] = None) -> List[str]:
+        """
+        Images to drop so no capped tag covers more than max_share of the set
+
+        max_share defaults to SHARE_SLACK x the balanced share, and a cap
+        below the balanced share is refused - no amount of dropping meets it.
+        The cap is a share of the dataset as it is now, so it doesn't shrink
+        as images are dropped. Each step drops the image that carries the
+        most over-cap tags.
+        """
+        balanced = self.balanced_share(dataset, tags)
+        if max_share is None:
+            max_share = min(1.0, balanced * SHARE_SLACK)
+        elif max_share < balanced:
+            raise ValueError(f"--max-share {max_share:.0%} is below the balanced share {balanced:.0%} "
+                             f"- even a perfectly balanced set can't go lower")
+
+        remaining = self.dataset_bitmap(dataset)
+        cap = max(1, int(max_share * remaining.bit_count()))
+        tags = self.capped_postings(dataset, tags)
+
+        dropped = 0
+        while True:
+            over = [bits & remaining for bits in tags if (bits & remaining).bit_count() > cap]
+            if not over:
+                break
+
+            # Pick the image that sits in the most over-cap postings
+            best_id, best_score = None, 0
+            for image_id in bits_to_ids(over[0]):
+                bit = 1 << image_id
+                score = sum(1 for bits in over if bits & bit)
+                if score > best_score:
+                    best_id, best_score = image_id, score
+            remaining &= ~(1 << best_id)
+            dropped |= 1 << best_id
+
+        return self.images(dropped)
+
+
+def export_tag_counts(index: CaptionIndex, output_file: str, dataset: str = None) -> Dict[str, int]:
+    """Write tag counts for auto_caption to balance new captions against"""
+    from dataset_writer import atomic_write_json
+    counts = index.tag_counts(dataset)
+    atomic_write_json(output_file, counts)
+    return counts
+
+
+def apply_rebalance(images: List[str]) -> int:
+    """Move dropped images and their captions into the dataset's .excluded folder"""
+    from dataset_writer import read_manifest, atomic_write_json, MANIFEST_FILE
+
+    moved = {}
+    for image_path in images:
+        dataset = os.path.dirname(image_path)
+        excluded = os.path.join(dataset, EXCLUDED_DIR)
+        os.makedirs(excluded, exist_ok=True)
+        for path in (image_path, os.path.splitext(image_path)[0] + '.txt'):
+            if os.path.exists(path):
+                os.replace(path, os.path.join(excluded, os.path.basename(path)))
+                moved.setdefault(dataset, set()).add(os.path.basename(path))
+
+    # Keep committed manifests in step with what's left in the dataset
+    for dataset, names in moved.items():
+        manifest = read_manifest(dataset)
+        if manifest and manifest.get('complete'):
+            manifest['files'] = [f for f in manifest.get('files', []) if f not in names]
+            atomic_write_json(os.path.join(dataset, MANIFEST_FILE), manifest)
+
+    return len(images)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='caption_index', description='Caption tag index')
+    parser.add_argument('--index', default=DEFAULT_INDEX, help='Index file location')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('build', help='Add / refresh caption files under these folders')
+    p.add_argument('roots', nargs='+')
+
+    p = commands.add_parser('query', help='Count (and list) images carrying tags')
+    p.add_argument('tags', nargs='+')
+    p.add_argument('--not', dest='none_of', action='append', default=[])
+    p.add_argument('--dataset')
+    p.add_argument('--list', action='store_true')
+
+    p = commands.add_parser('stats', help='Tag counts, most common first')
+    p.add_argument('--dataset')
+    p.add_argument('--top', type=int, default=30)
+
+    p = commands.add_parser('rebalance', help='Cap each specific tag at a share of a dataset')
+    p.add_argument('dataset')
+    p.add_argument('--max-share', type=float,
+                   help=f'Cap per tag (default: {SHARE_SLACK}x the evenly balanced share)')
+    p.add_argument('--tags', nargs='+', help='Tags to cap (default: auto_caption specific tags)')
+    p.add_argument('--apply', action='store_true', help='Move dropped images to .excluded/')
+    p.add_argument('--force', action='store_true',
+                   help=f'Apply even if more than {MAX_DROP_SHARE:.0%} of the dataset would go')
+
+    p = commands.add_parser('export', help=f'Write {TAG_COUNTS_FILE} for auto_caption')
+    p.add_argument('--dataset')
+    p.add_argument('--output')
+
+    args = parser.parse_args(argv)
+    index = CaptionIndex(args.index)
+
+    if args.command == 'build':
+        result = index.update(args.roots)
+        index.save()
+        print(f"📇 Index: {result['total']} images "
+              f"(+{result['added']} ~{result['updated']} -{result['removed']})")
+        return result
+
+    if args.command == 'query':
+        bitmap = index.query(args.tags, args.none_of, args.dataset)
+        print(f"🔎 {bitmap.bit_count()} images tagged {' + '.join(args.tags)}")
+        if args.list:
+            for path in index.images(bitmap):
+                print(f"   {path}")
+        return bitmap.bit_count()
+
+    if args.command == 'stats':
+        counts = index.tag_counts(args.dataset)
+        total = index.dataset_bitmap(args.dataset).bit_count()
+        print(f"📊 {total} images, {len(counts)} tags")
+        for tag, count in list(counts.items())[:args.top]:
+            print(f"   {count:5d}  {count / max(total, 1):6.1%}  {tag}")
+        return counts
+
+    if args.command == 'rebalance':
+        index.update([args.dataset])
+        balanced = index.balanced_share(args.dataset, args.tags)
+        max_share = args.max_share if args.max_share is not None else min(1.0, balanced * SHARE_SLACK)
+        try:
+            dropped = index.rebalance_plan(args.dataset, max_share, args.tags)
+        except ValueError as e:
+            print(f"⛔ {e}")
+            return []
+        total = index.dataset_bitmap(args.dataset).bit_count()
+        print(f"⚖️ Capping tags at {max_share:.0%} (balanced: {balanced:.0%}): "
+              f"drop {len(dropped)}/{total} images")
+        for path in dropped:
+            print(f"   - {os.path.basename(path)}")
+        too_many = len(dropped) > MAX_DROP_SHARE * total
+        if too_many:
+            print(f"⚠️ That drops over {MAX_DROP_SHARE:.0%} of the dataset - raise --max-share "
+                  f"or narrow --tags" + ("" if args.force else " (or pass --force to apply anyway)"))
+        if args.apply and dropped and too_many and not args.force:
+            print("⛔ Not applying")
+        elif args.apply and dropped:
+            apply_rebalance(dropped)
+            index.update([args.dataset])
+            print(f"📦 Moved {len(dropped)} images to {EXCLUDED_DIR}/")
+        index.save()
+        return dropped
+
+    if args.command == 'export':
+        if args.output:
+            output_file = args.output
+        elif args.dataset:
+            output_file = os.path.join(os.path.expanduser(args.dataset), TAG_COUNTS_FILE)
+        else:
+            output_file = os.path.join(os.path.dirname(index.index_path), TAG_COUNTS_FILE)
+        counts = export_tag_counts(index, output_file, args.dataset)
+        print(f"📤 Exported {len(counts)} tag counts to {output_file}")
+        return counts
+
+
+if __name__ == "__main__":
+    main()
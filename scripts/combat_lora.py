@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+combat-lora - One entry point for all dataset prep scripts
+
+Subcommands only import the script they need, and `worker` mode keeps one
+interpreter alive for many jobs so the orchestrator pays startup cost once.
+
+    combat-lora smart fight.mp4 --target-frames 40
+    combat-lora bulk ~/Downloads/punches --output-dir training_ready
+    combat-lora worker < jobs.jsonl
+    combat-lora worker --socket /tmp/combat-lora.sock
+
+Worker jobs are JSON lines: {"id": 1, "argv": ["bulk", "~/Downloads/punches"]}
+Each job gets one JSON reply line: {"id": 1, "ok": true, "result": 42}
+"""
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+
+def run_video(args):
+    from video_to_lora import extract_frames_from_video
+    return extract_frames_from_video(args.video, args.output_dir, fps=args.fps, combat_type=args.type)
+
+
+def run_videos(args):
+    from video_to_lora import process_multiple_videos
+    return process_multiple_videos(args.folder, combat_type=args.type)
+
+
+def run_smart(args):
+    from video_to_lora import smart_frame_extraction
+    return smart_frame_extraction(args.video, args.output_dir, target_frames=args.target_frames)
+
+
+def run_timestamps(args):
+    from video_to_lora import extract_at_timestamps
+    timestamps = list(args.timestamps)
+    if args.file:
+        with open(os.path.expanduser(args.file)) as f:
+            timestamps += [float(line) for line in f if line.strip()]
+    return extract_at_timestamps(args.video, timestamps, args.output_dir,
+                                 combat_type=args.type, workers=args.workers)
+
+
+def run_bulk(args):
+    from process_bulk import process_bulk_images
+    return process_bulk_images(args.source, args.output_dir, quality_filter=not args.no_quality_filter)
+
+
+def run_caption(args):
+    from auto_caption import CombatCaptionGenerator
+    captioner = CombatCaptionGenerator()
+    directory = os.path.expanduser(args.directory)
+    captions = captioner.auto_caption_directory(directory, args.type, write_config=True)
+    return len(captions)
+
+
+def run_scrape(args):
+    from scrape_images import CombatImageScraper
+    return CombatImageScraper().auto_collect_combat_dataset(args.type, target_count=args.count)
+
+
+def run_quality(args):
+    from image_quality import score_directory
+    return score_directory(args.folder)
+
+
+def run_profile(args):
+    from dataset_profiler import profile_dataset, recommend_settings, print_profile
+    profile = profile_dataset(args.folder)
+    settings = recommend_settings(profile)
+    print_profile(profile, settings)
+    return {'profile': profile, 'recommended_settings': settings}
+
+
+def run_tags(args):
+    from caption_index import main as caption_index_main
+    return caption_index_main(args.tag_args)
+
+
+def run_distributed(args):
+    from distributed_prep import main as distributed_main
+    return distributed_main(args.distributed_args)
+
+
+# Subcommands whose arguments belong to another script's own parser. argparse
+# won't give REMAINDER a leading --option, so they're forwarded by hand.
+PASSTHROUGH = {'tags': 'tag_args', 'distributed': 'distributed_args'}
+
+
+def parse_args(parser, argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] in PASSTHROUGH:
+        args = parser.parse_args(argv[:1])
+        setattr(args, PASSTHROUGH[argv[0]], argv[1:])
+        return args
+    return parser.parse_args(argv)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='combat-lora', description='Combat LoRA dataset prep')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('video', help='Extract frames from one video at a fixed rate')
+    p.add_argument('video')
+    p.add_argument('--output-dir', default='video_frames')
+    p.add_argument('--fps', type=float, default=2)
+    p.add_argument('--type', default='combat')
+    p.set_defaults(handler=run_video)
+
+    p = commands.add_parser('videos', help='Extract frames from every video in a folder')
+    p.add_argument('folder')
+    p.add_argument('--type', default='combat')
+    p.set_defaults(handler=run_videos)
+
+    p = commands.add_parser('smart', help='Motion-planned extraction of the best frames')
+    p.add_argument('video')
+    p.add_argument('--output-dir', default='smart_frames')
+    p.add_argument('--target-frames', type=int, default=30)
+    p.set_defaults(handler=run_smart)
+
+    p = commands.add_parser('timestamps', help='Extract frames at known timestamps (seconds)')
+    p.add_argument('video')
+    p.add_argument('timestamps', nargs='*', type=float)
+    p.add_argument('--file', help='Text file with one timestamp per line')
+    p.add_argument('--output-dir', default='timestamp_frames')
+    p.add_argument('--type', default='combat')
+    p.add_argument('--workers', type=int)
+    p.set_defaults(handler=run_timestamps)
+
+    p = commands.add_parser('bulk', help='Resize, filter and caption a folder of images')
+    p.add_argument('source')
+    p.add_argument('--output-dir', default='training_ready')
+    p.add_argument('--no-quality-filter', action='store_true')
+    p.set_defaults(handler=run_bulk)
+
+    p = commands.add_parser('caption', help='Auto-caption a folder and write its training config')
+    p.add_argument('directory')
+    p.add_argument('--type', default='punching')
+    p.set_defaults(handler=run_caption)
+
+    p = commands.add_parser('scrape', help='Download free combat images')
+    p.add_argument('--type', default='punching')
+    p.add_argument('--count', type=int, default=30)
+    p.set_defaults(handler=run_scrape)
+
+    p = commands.add_parser('quality', help='Score image quality and write quality_scores.json')
+    p.add_argument('folder')
+    p.set_defaults(handler=run_quality)
+
+    p = commands.add_parser('profile', help='Profile a dataset and recommend training settings')
+    p.add_argument('folder')
+    p.set_defaults(handler=run_profile)
+
+    p = commands.add_parser('tags', help='Caption tag index: build, query, stats, rebalance, export')
+    p.add_argument('tag_args', nargs=argparse.REMAINDER)
+    p.set_defaults(handler=run_tags)
+
+    p = commands.add_parser('distributed', help='Sharded prep across machines: plan, worker, merge, status, local')
+    p.add_argument('distributed_args', nargs=argparse.REMAINDER)
+    p.set_defaults(handler=run_distributed)
+
+    p = commands.add_parser('worker', help='Run many jobs in one process (JSON lines)')
+    p.add_argument('--socket', help='Listen on this Unix socket instead of stdin/stdout')
+    p.set_defaults(handler=run_worker)
+
+    return parser
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """
+    Send everything a job prints to stderr - Python prints and the output
+    of any ffmpeg / worker processes it starts, which write to fd 1 directly
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def run_job(parser, line):
+    """Run one JSON job line and return the JSON reply line"""
+    job_id = None
+    try:
+        job = json.loads(line)
+        job_id = job.get('id')
+        args = parse_args(parser, job['argv'])
+        if args.command == 'worker':
+            raise ValueError("workers can't start workers")
+
+        # Job chatter goes to stderr so stdout stays one reply per job
+        from resource_guard import reset_peak_rss
+        reset_peak_rss()  # Peak-memory reports cover this job, not the worker's lifetime
+        with stdout_to_stderr():
+            result = args.handler(args)
+        reply = {'id': job_id, 'ok': True, 'result': result}
+    except SystemExit:
+        reply = {'id': job_id, 'ok': False, 'error': 'invalid arguments'}
+    except Exception as e:
+        reply = {'id': job_id, 'ok': False, 'error': str(e)}
+    return json.dumps(reply, default=str) + '\n'
+
+
+def run_worker(args):
+    parser = build_parser()
+
+    if not args.socket:
+        for line in sys.stdin:
+            if line.strip():
+                sys.stdout.write(run_job(parser, line))
+                sys.stdout.flush()
+        return None
+
+    import socketserver
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode('utf-8')
+                if line.strip():
+                    self.wfile.write(run_job(parser, line).encode('utf-8'))
+                    self.wfile.flush()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    print(f"🛠️ combat-lora worker listening on {args.socket}", file=sys.stderr)
+    with socketserver.UnixStreamServer(args.socket, JobHandler) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+    return None
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parse_args(parser, argv)
+    result = args.handler(args)
+    if isinstance(result, dict):
+        print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Dataset Profiler - Derives training settings from what's actually in a dataset
+Counts near-duplicate clusters, resolutions and caption tags in one pass
+"""
+
+import os
+import sys
+import json
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from resource_guard import configure_pil, check_decode, retry_on_budget, BudgetExceeded
+
+configure_pil()
+
+THUMB_SIZE = 12            # Grayscale layout thumbnail, THUMB_SIZE x THUMB_SIZE
+COLOR_BINS = 8             # Per-channel color histogram bins
+CLUSTER_SIMILARITY = 0.90  # Cosine similarity above which two images count as "the same shot"
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.bmp']
+
+
+def image_features(image_path: str):
+    """Feature vector (layout + color) and original size of one image"""
+    with Image.open(image_path) as img:
+        original_size = img.size
+        img.draft('RGB', (64, 64))
+        check_decode(img, image_path)
+        rgb = img.convert('RGB').resize((64, 64), Image.Resampling.BILINEAR)
+        pixels = np.asarray(rgb, dtype=np.float32)
+
+    layout = np.asarray(rgb.convert('L').resize((THUMB_SIZE, THUMB_SIZE), Image.Resampling.BILINEAR),
+                        dtype=np.float32).ravel()
+    layout -= layout.mean()
+    layout /= np.linalg.norm(layout) + 1e-6
+
+    bins = (pixels * COLOR_BINS // 256).astype(np.int64).reshape(-1, 3)
+    color = np.concatenate([np.bincount(bins[:, c], minlength=COLOR_BINS) for c in range(3)])
+    color = color.astype(np.float32)
+    color /= np.linalg.norm(color) + 1e-6
+
+    return np.concatenate([layout, color]) / np.sqrt(2), original_size
+
+
+def count_clusters(features: np.ndarray, similarity: float = CLUSTER_SIMILARITY) -> np.ndarray:
+    """
+    Greedy leader clustering on L2-normalised feature rows
+
+    Each unassigned image becomes a leader and claims every unassigned image
+    at least `similarity` close to it. Returns a cluster label per row.
+    """
+    labels = np.full(len(features), -1, dtype=np.int64)
+    cluster = 0
+    for leader in range(len(features)):
+        if labels[leader] >= 0:
+            continue
+        close = (features @ features[leader] >= similarity) & (labels < 0)
+        labels[close] = cluster
+        labels[leader] = cluster
+        cluster += 1
+    return labels
+
+
+def caption_tags(image_path: str) -> List[str]:
+    """Comma separated tags from the caption file next to an image"""
+    caption_file = os.path.splitext(image_path)[0] + '.txt'
+    if not os.path.exists(caption_file):
+        return []
+    with open(caption_file) as f:
+        return [t.strip().lower() for t in f.read().split(',') if t.strip()]
+
+
+def profile_dataset(directory: str, image_paths: List[str] = None) -> Dict:
+    """Collect diversity, resolution and caption stats for a dataset folder"""
+
+    directory = os.path.expanduser(directory)
+    if image_paths is None:
+        image_paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                             if any(f.lower().endswith(ext) for ext in IMAGE_EXTENSIONS))
+
+    features, sizes, tag_lists = [], [], []
+    for path in image_paths:
+        try:
+            vector, size = retry_on_budget(image_features, path)
+        except BudgetExceeded:
+            raise  # A profile missing images would skew the recommended settings
+        except Exception as e:
+            print(f"Skipping {os.path.basename(path)} in profile: {e}")
+            continue
+        features.append(vector)
+        sizes.append(size)
+        tag_lists.append(caption_tags(path))
+
+    if not features:
+        return {'images': 0, 'clusters': 0}
+
+    labels = count_clusters(np.stack(features))
+    cluster_sizes = np.bincount(labels)
+    short_sides = np.asarray(sizes).min(axis=1)
+    long_sides = np.asarray(sizes).max(axis=1)
+
+    tag_counts = {}
+    for tags in tag_lists:
+        for tag in tags:
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    tags_per_caption = np.asarray([len(t) for t in tag_lists])
+
+    # Tags on every caption (trigger word, base tags) say nothing about variety
+    varying = np.asarray([c for c in tag_counts.values() if c < len(tag_lists)], dtype=np.float64)
+    if varying.size:
+        p = varying / varying.sum()
+        tag_entropy = float(-(p * np.log2(p)).sum())
+    else:
+        tag_entropy = 0.0
+
+    return {
+        'images': len(features),
+        'clusters': int(len(cluster_sizes)),
+        'largest_cluster': int(cluster_sizes.max()),
+        'redundancy': round(1 - len(cluster_sizes) / len(features), 3),
+        'resolution': {
+            'min': int(short_sides.min()),
+            'median': int(np.median(short_sides)),
+            'median_long_side': int(np.median(long_sides)),
+            'max': int(short_sides.max()),
+            'under_512': int((short_sides < 512).sum()),
+            'over_1024': int((short_sides >= 1024).sum())
+        },
+        'captions': {
+            'captioned': int((tags_per_caption > 0).sum()),
+            'unique_tags': len(tag_counts),
+            'mean_tags': round(float(tags_per_caption.mean()), 2),
+            'tag_entropy': round(tag_entropy, 3)
+        }
+    }
+
+
+def recommend_settings(profile: Dict) -> Dict:
+    """
+    Turn a dataset profile into steps / rank / learning rate
+
+    Steps follow the number of distinct shots, not the raw image count, so a
+    folder of 60 near-identical video frames trains like a folder of 10.
+    """
+    effective = profile.get('clusters', 0)
+    redundant = profile.get('images', 0) - effective
+
+    steps = 400 + 60 * effective + 5 * redundant
+    steps = int(min(3000, max(500, round(steps / 50) * 50)))
+
+    if effective < 15:
+        network_dim = 16
+    elif effective < 40:
+        network_dim = 32
+    else:
+        network_dim = 64
+
+    # Identical captions everywhere leave nothing for extra rank to separate
+    if profile.get('captions', {}).get('tag_entropy', 0) == 0:
+        network_dim = min(network_dim, 32)
+
+    # Few distinct shots overfit quickly - slow down rather than memorise them
+    if effective < 8:
+        learning_rate = 0.0002
+    elif effective < 20:
+        learning_rate = 0.0003
+    else:
+        learning_rate = 0.0004
+
+    # Bucketed trainers keep aspect ratio, so a 1024x576 frame trains at
+    # 1024 - judge by the long side, not the short one
+    median_side = profile.get('resolution', {}).get('median_long_side', 1024)
+    if median_side >= 896:
+        resolution = 1024
+    elif median_side >= 640:
+        resolution = 768
+    else:
+        resolution = 512
+
+    return {
+        'steps': steps,
+        'learning_rate': learning_rate,
+        'network_dim': network_dim,
+        'resolution': resolution
+    }
+
+
+def print_profile(profile: Dict, settings: Dict):
+    """Short human summary"""
+    print(f"🧬 Dataset profile: {profile['images']} images, "
+          f"{profile['clusters']} distinct shots ({profile.get('redundancy', 0):.0%} redundant)")
+    print(f"⚡ Recommended: {settings['steps']} steps, rank {settings['network_dim']}, "
+          f"lr {settings['learning_rate']}, {settings['resolution']}px")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python dataset_profiler.py <dataset_folder>")
+        sys.exit(1)
+
+    profile = profile_dataset(sys.argv[1])
+    settings = recommend_settings(profile)
+    print_profile(profile, settings)
+    print(json.dumps({'profile': profile, 'recommended_settings': settings}, indent=2))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Dataset Writer - Crash-safe output for every prep script
+
+Files are written into a hidden staging folder and published into the
+dataset with atomic renames, a batch at a time. The manifest.json is the
+commit marker: it says "complete": false while a run is in progress and is
+only rewritten as "complete": true once every file is in place, so
+downstream steps can trust a dataset without rescanning it.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+from typing import Dict, List
+
+MANIFEST_FILE = 'manifest.json'
+STAGING_PREFIX = '.staging-'
+
+
+def resolve_output_path(output_dir: str) -> str:
+    """
+    Dataset folders live under ~/combat-lora-maker (or $COMBAT_LORA_HOME)
+    unless output_dir is already an absolute path
+    """
+    output_dir = os.path.expanduser(output_dir)
+    if os.path.isabs(output_dir):
+        return output_dir
+    base = os.environ.get('COMBAT_LORA_HOME', '~/combat-lora-maker')
+    return os.path.join(os.path.expanduser(base), output_dir)
+
+
+def fsync_dir(path: str):
+    """Persist renames/unlinks inside a directory"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_filesystem(path: str) -> bool:
+    """
+    syncfs() the filesystem holding path - one call flushes a whole batch
+    of staged files. False where syncfs isn't available (non-Linux).
+    """
+    try:
+        import ctypes
+        syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return False
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return syncfs(fd) == 0
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, data):
+    """Write a JSON file so readers see either the old or the new version"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def read_manifest(path: str):
+    """Return a dataset's manifest, or None for datasets written before manifests"""
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def is_complete(path: str) -> bool:
+    """False only for datasets whose last run never committed"""
+    manifest = read_manifest(path)
+    return manifest is None or bool(manifest.get('complete'))
+
+
+def staging_name() -> str:
+    """Unique per process across hosts sharing a filesystem"""
+    return f"{STAGING_PREFIX}{socket.gethostname()}-{os.getpid()}"
+
+
+def remove_stale_staging(path: str):
+    """
+    Clear staging folders left behind by runs that crashed. Only folders
+    from this host are checked - another node's pids mean nothing here.
+    """
+    host = socket.gethostname()
+    for entry in os.listdir(path):
+        if not entry.startswith(STAGING_PREFIX):
+            continue
+        owner, _, pid = entry[len(STAGING_PREFIX):].rpartition('-')
+        if owner and owner != host:
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue  # Still running - leave it alone
+        except (ValueError, ProcessLookupError):
+            pass
+        except PermissionError:
+            continue
+        shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+class DatasetWriter:
+    """Stage files, then publish them into output_path in fsync'd batches"""
+
+    def __init__(self, output_path: str, batch_size: int = 32):
+        self.output_path = output_path
+        self.batch_size = batch_size
+        os.makedirs(output_path, exist_ok=True)
+        remove_stale_staging(output_path)
+
+        self.staging = os.path.join(output_path, staging_name())
+        os.makedirs(self.staging, exist_ok=True)
+        self.pending: List[str] = []
+        self.files: List[str] = []
+        self.included: List[str] = []
+        self.carried: Dict = {}
+
+        # Mark the dataset as in-progress until commit() says otherwise
+        self.previous_manifest = read_manifest(output_path)
+        atomic_write_json(os.path.join(output_path, MANIFEST_FILE),
+                          {'complete': False, 'started': time.time()})
+
+    def path_for(self, name: str) -> str:
+        """Where to write `name` before it is published - call add(name) afterwards"""
+        return os.path.join(self.staging, name)
+
+    def add(self, name: str):
+        """Queue a staged file for publishing"""
+        self.pending.append(name)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def include(self, name: str):
+        """List a file that is already in the dataset (e.g. images being captioned)"""
+        self.included.append(name)
+
+    def keep_previous(self):
+        """
+        Carry the last committed manifest's files and metadata into this
+        run, for steps that update a dataset in place (e.g. captioning)
+        """
+        previous = self.previous_manifest or {}
+        if not previous.get('complete'):
+            return
+        for name in previous.get('files', []):
+            if os.path.exists(os.path.join(self.output_path, name)):
+                self.include(name)
+        self.carried = {k: v for k, v in previous.items()
+                        if k not in ('complete', 'committed', 'started', 'files')}
+
+    def write_text(self, name: str, text: str):
+        with open(self.path_for(name), 'w') as f:
+            f.write(text)
+        self.add(name)
+
+    def write_json(self, name: str, data):
+        with open(self.path_for(name), 'w') as f:
+            json.dump(data, f, indent=2)
+        self.add(name)
+
+    def flush(self):
+        """Publish the pending batch: one filesystem sync, rename, one directory fsync"""
+        if not self.pending:
+            return
+
+        # Per-file fsync only where syncfs is unavailable
+        if not sync_filesystem(self.staging):
+            for name in self.pending:
+                fd = os.open(self.path_for(name), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+        for name in self.pending:
+            os.replace(self.path_for(name), os.path.join(self.output_path, name))
+        fsync_dir(self.output_path)
+
+        self.files.extend(self.pending)
+        self.pending = []
+
+    def commit(self, extra: Dict = None) -> Dict:
+        """Publish everything left and write the completed manifest"""
+        self.flush()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+        manifest = {
+            'complete': True,
+            'committed': time.time(),
+            'files': sorted(set(self.files + self.included))
+        }
+        manifest.update(self.carried)
+        if extra:
+            manifest.update(extra)
+        atomic_write_json(os.path.join(self.output_path, MANIFEST_FILE), manifest)
+        return manifest
+
+    def abort(self):
+        """
+        Drop staged files. If nothing was published yet the dataset is
+        untouched and its previous manifest comes back; otherwise it stays
+        marked incomplete.
+        """
+        self.pending = []
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+        if not self.files:
+            manifest_file = os.path.join(self.output_path, MANIFEST_FILE)
+            if self.previous_manifest is not None:
+                atomic_write_json(manifest_file, self.previous_manifest)
+            else:
+                os.remove(manifest_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python dataset_writer.py <dataset_folder> [...]")
+        sys.exit(1)
+
+    incomplete = [p for p in sys.argv[1:] if not is_complete(p)]
+    for path in incomplete:
+        print(f"⚠️ Incomplete dataset: {path}")
+    sys.exit(1 if incomplete else 0)
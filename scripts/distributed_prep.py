@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Distributed Dataset Prep - Shard bulk image / video prep across machines
+
+Everything lives in one job folder on a shared filesystem:
+
+    plan.json     source items, their content hashes and shard numbers
+    leases.db     SQLite lease table - workers claim shards from it
+    shards/       one crash-safe dataset per shard, with its own manifest
+
+Items are assigned to shards by content hash and named by it, so which
+worker runs which shard never changes the merged result.
+
+    python distributed_prep.py plan ~/raw_punches /shared/job --shards 32
+    python distributed_prep.py worker /shared/job          # on every node
+    python distributed_prep.py merge /shared/job /shared/punch_dataset
+    python distributed_prep.py local ~/raw_punches /tmp/job /tmp/out --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, List
+
+from dataset_writer import (DatasetWriter, atomic_write_json, read_manifest,
+                            resolve_output_path)
+from resource_guard import RSS_BUDGET_MB, print_peak_memory
+
+PLAN_FILE = 'plan.json'
+LEASE_DB = 'leases.db'
+SHARDS_DIR = 'shards'
+LEASE_SECONDS = 900
+MAX_ATTEMPTS = 3  # A shard that fails this many times is marked failed and skipped
+SAMPLE_BYTES = 1 << 20  # Videos are hashed from three 1MB samples plus their size
+
+
+def content_hash(path: str, sampled: bool = False) -> str:
+    """SHA-1 of a file's bytes (or of size + head/middle/tail samples for big videos)"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if not sampled:
+            for chunk in iter(lambda: f.read(SAMPLE_BYTES), b''):
+                digest.update(chunk)
+        else:
+            size = os.fstat(f.fileno()).st_size
+            digest.update(str(size).encode())
+            for offset in (0, max(0, size // 2 - SAMPLE_BYTES // 2), max(0, size - SAMPLE_BYTES)):
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def shard_dir(job_dir: str, shard: int) -> str:
+    return os.path.join(job_dir, SHARDS_DIR, f"shard_{shard:04d}")
+
+
+def connect(job_dir: str):
+    conn = sqlite3.connect(os.path.join(job_dir, LEASE_DB), timeout=60, isolation_level=None)
+    conn.execute("""CREATE TABLE IF NOT EXISTS leases (
+        shard INTEGER PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        finished REAL
+    )""")
+    return conn
+
+
+def load_plan(job_dir: str) -> Dict:
+    with open(os.path.join(job_dir, PLAN_FILE)) as f:
+        return json.load(f)
+
+
+# -- coordinator --
+
+def plan_job(source: str, job_dir: str, kind: str = 'images', shards: int = 16,
+             target_frames: int = 30) -> Dict:
+    """
+    Hash every source item and assign it to a shard
+
+    Re-planning an unchanged source keeps the existing leases, so finished
+    shards aren't redone, and gives failed shards another MAX_ATTEMPTS.
+    A changed source resets the job.
+    """
+    source = os.path.abspath(os.path.expanduser(source))
+    job_dir = os.path.abspath(os.path.expanduser(job_dir))
+    os.makedirs(job_dir, exist_ok=True)
+
+    if kind == 'images':
+        from process_bulk import find_images
+        paths = find_images(source)
+    else:
+        from video_to_lora import VIDEO_EXTENSIONS
+        paths = [os.path.join(root, f) for root, _, files in os.walk(source) for f in files
+                 if any(f.lower().endswith(ext) for ext in VIDEO_EXTENSIONS)]
+
+    # Identical content collapses to one item - first path wins
+    items = {}
+    for path in sorted(paths):
+        digest = content_hash(path, sampled=(kind == 'videos'))
+        items.setdefault(digest, path)
+
+    plan = {
+        'kind': kind,
+        'source': source,
+        'shards': shards,
+        'target_frames': target_frames,
+        'items': [{'hash': h, 'path': items[h], 'shard': int(h, 16) % shards} for h in sorted(items)]
+    }
+
+    plan_file = os.path.join(job_dir, PLAN_FILE)
+    previous = load_plan(job_dir) if os.path.exists(plan_file) else None
+    if previous != plan:
+        if previous is not None:
+            print("♻️ Source changed since the last plan - resetting job")
+        shutil.rmtree(os.path.join(job_dir, SHARDS_DIR), ignore_errors=True)
+        conn = connect(job_dir)
+        conn.execute("DELETE FROM leases")
+        conn.close()
+        atomic_write_json(plan_file, plan)
+
+    conn = connect(job_dir)
+    conn.executemany("INSERT OR IGNORE INTO leases (shard) VALUES (?)",
+                     [(s,) for s in range(shards)])
+    conn.execute("UPDATE leases SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+    conn.close()
+
+    print(f"🗂️ Planned {len(plan['items'])} {kind} into {shards} shards at {job_dir}")
+    return plan
+
+
+def job_status(job_dir: str) -> Dict[str, int]:
+    conn = connect(job_dir)
+    rows = conn.execute("SELECT status, COUNT(*) FROM leases GROUP BY status").fetchall()
+    conn.close()
+    return dict(rows)
+
+
+# -- worker --
+
+class LeaseLost(RuntimeError):
+    """Another worker took over the shard after this worker's lease expired"""
+
+
+class ShardLease:
+    """A worker's hold on one shard in the lease table"""
+
+    def __init__(self, job_dir: str, worker_id: str, lease_seconds: int = LEASE_SECONDS):
+        self.job_dir = job_dir
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.shard = None
+
+    def claim(self):
+        """Take the lowest pending (or expired) shard; None when nothing is left"""
+        conn = connect(self.job_dir)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Workers keep dying on these (e.g. OOM-killed) - stop handing them out
+            conn.execute("UPDATE leases SET status = 'failed' WHERE status = 'leased' "
+                         "AND expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+            row = conn.execute(
+                "SELECT shard FROM leases WHERE status = 'pending' "
+                "OR (status = 'leased' AND expires < ?) ORDER BY shard LIMIT 1", (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE leases SET status = 'leased', worker = ?, expires = ?, "
+                    "attempts = attempts + 1 WHERE shard = ?",
+                    (self.worker_id, now + self.lease_seconds, row[0])
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self.shard = row[0] if row else None
+        return self.shard
+
+    def renew(self) -> bool:
+        """Push the lease expiry out - False if this worker no longer holds it"""
+        conn = connect(self.job_dir)
+        cursor = conn.execute(
+            "UPDATE leases SET expires = ? WHERE shard = ? AND worker = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, self.shard, self.worker_id)
+        )
+        conn.close()
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def heartbeat(self):
+        """Renew the lease from a background thread while a shard is processed"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew()
+                except sqlite3.Error as e:
+                    print(f"⚠️ {self.worker_id}: lease renewal failed: {e}")
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def check(self):
+        """Raise LeaseLost unless this worker still holds the shard"""
+        if not self.renew():
+            raise LeaseLost(f"lease on shard {self.shard} was taken over")
+
+    def finish(self) -> bool:
+        """Mark the shard done - False if the lease expired and someone else took it"""
+        conn = connect(self.job_dir)
+        cursor = conn.execute(
+            "UPDATE leases SET status = 'done', finished = ? WHERE shard = ? AND worker = ?",
+            (time.time(), self.shard, self.worker_id)
+        )
+        conn.close()
+        return cursor.rowcount == 1
+
+    def release(self) -> str:
+        """Give the shard back after a failure, or mark it failed after MAX_ATTEMPTS"""
+        conn = connect(self.job_dir)
+        conn.execute(
+            "UPDATE leases SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL WHERE shard = ? AND worker = ?",
+            (MAX_ATTEMPTS, self.shard, self.worker_id)
+        )
+        row = conn.execute("SELECT status FROM leases WHERE shard = ?", (self.shard,)).fetchone()
+        conn.close()
+        return row[0]
+
+
+def process_image_shard(items: List[Dict], output_path: str, lease: ShardLease,
+                        quality_filter: bool = True) -> Dict:
+    """Prepare one shard of images into its own dataset, named by content hash"""
+    from process_bulk import prepare_image, BULK_CAPTION
+    from resource_guard import retry_on_budget, BudgetExceeded
+
+    passed = {item['hash']: True for item in items}
+    if quality_filter and items:
+        from image_quality import score_images
+        scores = score_images([item['path'] for item in items])
+        passed = {item['hash']: score['passed'] for item, score in zip(items, scores)}
+
+    rejected = []
+    with DatasetWriter(output_path) as writer:
+        for item in items:
+            if not passed[item['hash']]:
+                rejected.append(item['path'])
+                continue
+            name = item['hash'][:16]
+            try:
+                retry_on_budget(prepare_image, item['path'], writer.path_for(f"{name}.jpg"))
+                writer.add(f"{name}.jpg")
+                writer.write_text(f"{name}.txt", BULK_CAPTION)
+            except BudgetExceeded:
+                raise  # Release the shard for another try rather than reject the image
+            except Exception as e:
+                print(f"Error processing {item['path']}: {e}")
+                rejected.append(item['path'])
+
+        lease.check()
+        return writer.commit({
+            'shard': lease.shard,
+            'worker': lease.worker_id,
+            'sources': {item['hash'][:16]: item['path'] for item in items if item['path'] not in rejected},
+            'rejected': rejected
+        })
+
+
+def process_video_shard(items: List[Dict], output_path: str, lease: ShardLease,
+                        target_frames: int = 30) -> Dict:
+    """Smart-extract every video in a shard into its own sub-dataset"""
+    from video_to_lora import smart_frame_extraction
+
+    with DatasetWriter(output_path) as writer:
+        datasets = {}
+        for item in items:
+            name = item['hash'][:16]
+            if smart_frame_extraction(item['path'], os.path.join(output_path, name), target_frames):
+                datasets[name] = item['path']
+
+        lease.check()
+        return writer.commit({
+            'shard': lease.shard,
+            'worker': lease.worker_id,
+            'datasets': sorted(datasets),
+            'sources': datasets
+        })
+
+
+def run_worker(job_dir: str, worker_id: str = None, lease_seconds: int = LEASE_SECONDS,
+               quality_filter: bool = True) -> int:
+    """Claim and process shards until none are left"""
+    job_dir = os.path.abspath(os.path.expanduser(job_dir))
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    plan = load_plan(job_dir)
+    lease = ShardLease(job_dir, worker_id, lease_seconds)
+
+    done = 0
+    while lease.claim() is not None:
+        items = [item for item in plan['items'] if item['shard'] == lease.shard]
+        print(f"🔧 {worker_id}: shard {lease.shard} ({len(items)} items)")
+        try:
+            with lease.heartbeat():
+                if plan['kind'] == 'images':
+                    process_image_shard(items, shard_dir(job_dir, lease.shard), lease, quality_filter)
+                else:
+                    process_video_shard(items, shard_dir(job_dir, lease.shard), lease, plan['target_frames'])
+        except LeaseLost as e:
+            print(f"⚠️ {worker_id}: {e}")
+            continue
+        except Exception as e:
+            status = lease.release()
+            print(f"❌ {worker_id}: shard {lease.shard} failed ({e}) - now {status}")
+            continue
+        if lease.finish():
+            done += 1
+        else:
+            print(f"⚠️ {worker_id}: lease on shard {lease.shard} expired before it finished")
+
+    print(f"✅ {worker_id}: finished {done} shards")
+    print_peak_memory()
+    return done
+
+
+# -- merge --
+
+def merge_job(job_dir: str, output_dir: str, prefix: str = None) -> int:
+    """Combine every shard's dataset into one, numbered in content-hash order"""
+    job_dir = os.path.abspath(os.path.expanduser(job_dir))
+    plan = load_plan(job_dir)
+    prefix = prefix or ('punch' if plan['kind'] == 'images' else 'combat')
+
+    status = job_status(job_dir)
+    unfinished = sum(n for s, n in status.items() if s not in ('done', 'failed'))
+    if unfinished:
+        raise RuntimeError(f"{unfinished} shards are not finished yet")
+
+    conn = connect(job_dir)
+    failed = [row[0] for row in conn.execute("SELECT shard FROM leases WHERE status = 'failed' ORDER BY shard")]
+    conn.close()
+    if failed:
+        print(f"⚠️ Skipping {len(failed)} failed shards: {failed}")
+
+    # (sort key, image path, source) for every committed frame/image
+    entries = []
+    workers = {}
+    for shard in range(plan['shards']):
+        if shard in failed:
+            continue
+        path = shard_dir(job_dir, shard)
+        manifest = read_manifest(path) if os.path.isdir(path) else None
+        if manifest is None:
+            continue  # Shard had no items
+        if not manifest.get('complete'):
+            raise RuntimeError(f"Shard {shard} has no committed manifest")
+        workers[shard] = manifest.get('worker')
+
+        if plan['kind'] == 'images':
+            for name in manifest['files']:
+                if name.endswith('.jpg'):
+                    key = name[:-4]
+                    entries.append((key, os.path.join(path, name), manifest['sources'].get(key)))
+        else:
+            for dataset in manifest['datasets']:
+                sub_path = os.path.join(path, dataset)
+                sub_manifest = read_manifest(sub_path) or {}
+                for name in sub_manifest.get('files', []):
+                    if name.endswith('.jpg'):
+                        entries.append((f"{dataset}/{name}", os.path.join(sub_path, name),
+                                        manifest['sources'][dataset]))
+
+    entries.sort()
+    output_path = resolve_output_path(output_dir)
+    with DatasetWriter(output_path) as writer:
+        sources = {}
+        for idx, (_, image_path, source) in enumerate(entries, 1):
+            name = f"{prefix}_{idx:03d}"
+            shutil.copyfile(image_path, writer.path_for(f"{name}.jpg"))
+            writer.add(f"{name}.jpg")
+            caption_path = os.path.splitext(image_path)[0] + '.txt'
+            if os.path.exists(caption_path):
+                shutil.copyfile(caption_path, writer.path_for(f"{name}.txt"))
+                writer.add(f"{name}.txt")
+            sources[f"{name}.jpg"] = source
+
+        from dataset_profiler import profile_dataset, recommend_settings, print_profile
+        writer.flush()
+        profile = profile_dataset(output_path, [os.path.join(output_path, f)
+                                                for f in writer.files if f.endswith('.jpg')])
+        recommended = recommend_settings(profile)
+        print_profile(profile, recommended)
+
+        writer.write_json('training_config.json', {
+            'dataset': output_dir,
+            'images_count': len(entries),
+            'trigger_word': f"{prefix}style",
+            'recommended_settings': recommended,
+            'dataset_profile': profile
+        })
+        writer.commit({'images_count': len(entries), 'job': job_dir, 'failed_shards': failed,
+                       'shard_workers': workers, 'sources': sources})
+
+    print(f"🧩 Merged {len(entries)} images from {len(workers)} shards into {output_path}")
+    print_peak_memory()
+    return len(entries)
+
+
+def run_local(source: str, job_dir: str, output_dir: str, workers: int = 4, **plan_args) -> int:
+    """
+    Plan, run several worker processes on this machine, then merge
+
+    The RSS budget is split evenly between the workers.
+    """
+    plan_job(source, job_dir, **plan_args)
+    env = dict(os.environ, COMBAT_LORA_RSS_MB=str(RSS_BUDGET_MB // workers))
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', job_dir,
+                               '--worker-id', f"local-{n}"], env=env)
+             for n in range(workers)]
+    failed = [p for p in procs if p.wait() != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} workers failed")
+    return merge_job(job_dir, output_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='distributed_prep', description='Sharded dataset prep')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_plan_args(p):
+        p.add_argument('--kind', choices=['images', 'videos'], default='images')
+        p.add_argument('--shards', type=int, default=16)
+        p.add_argument('--target-frames', type=int, default=30)
+
+    p = commands.add_parser('plan', help='Hash sources and create the shard lease table')
+    p.add_argument('source')
+    p.add_argument('job_dir')
+    add_plan_args(p)
+
+    p = commands.add_parser('worker', help='Claim and process shards until none are left')
+    p.add_argument('job_dir')
+    p.add_argument('--worker-id')
+    p.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS)
+    p.add_argument('--no-quality-filter', action='store_true')
+
+    p = commands.add_parser('merge', help='Combine finished shards into one dataset')
+    p.add_argument('job_dir')
+    p.add_argument('output_dir')
+    p.add_argument('--prefix')
+
+    p = commands.add_parser('status', help='Shard counts by lease status')
+    p.add_argument('job_dir')
+
+    p = commands.add_parser('local', help='Plan, run N local workers and merge')
+    p.add_argument('source')
+    p.add_argument('job_dir')
+    p.add_argument('output_dir')
+    p.add_argument('--workers', type=int, default=4)
+    add_plan_args(p)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'plan':
+        plan = plan_job(args.source, args.job_dir, args.kind, args.shards, args.target_frames)
+        return len(plan['items'])
+    if args.command == 'worker':
+        return run_worker(args.job_dir, args.worker_id, args.lease_seconds,
+                          quality_filter=not args.no_quality_filter)
+    if args.command == 'merge':
+        return merge_job(args.job_dir, args.output_dir, args.prefix)
+    if args.command == 'status':
+        status = job_status(args.job_dir)
+        print(f"📊 {status}")
+        return status
+    if args.command == 'local':
+        return run_local(args.source, args.job_dir, args.output_dir, args.workers,
+                         kind=args.kind, shards=args.shards, target_frames=args.target_frames)
+
+
+if __name__ == "__main__":
+    main()
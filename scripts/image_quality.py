@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Image Quality Scoring - Rejects blurry, badly exposed and tiny images
+All metrics run on small grayscale NumPy arrays, a batch at a time
+"""
+
+import os
+import sys
+import json
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from resource_guard import configure_pil, check_decode, retry_on_budget, BudgetExceeded
+
+configure_pil()  # Oversized sources are rejected as unreadable rather than decoded
+
+# Images are squashed to this square before scoring so a whole batch can be
+# stacked into one array. Thresholds below are calibrated for this size.
+ANALYSIS_SIZE = 256
+HISTOGRAM_BINS = 16
+QUALITY_SIDECAR = 'quality_scores.json'
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.bmp']
+
+DEFAULT_THRESHOLDS = {
+    'min_sharpness': 60.0,     # Laplacian variance - motion blur lands well below this
+    'min_brightness': 15.0,    # Mean gray level (0-255)
+    'max_brightness': 240.0,
+    'max_clipped': 0.9,        # Fraction crushed/blown - black studio backdrops are fine, fades are not
+    'max_noise': 12.0,         # Estimated noise sigma
+    'min_resolution': 256      # Shorter side of the original image, in pixels
+}
+
+
+def load_analysis_array(image_path: str):
+    """Decode an image as a small grayscale array plus its original size"""
+    with Image.open(image_path) as img:
+        original_size = img.size
+        # JPEG can decode straight to a reduced scale - far cheaper than full decode
+        img.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+        check_decode(img, image_path)
+        small = img.convert('L').resize((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.Resampling.BILINEAR)
+        return np.asarray(small, dtype=np.float32), original_size
+
+
+def compute_metrics(batch: np.ndarray, sizes: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Score a stacked batch of grayscale images, shape (N, H, W)
+
+    Returns one array per metric, each of length N.
+    """
+    center = batch[:, 1:-1, 1:-1]
+    up, down = batch[:, :-2, 1:-1], batch[:, 2:, 1:-1]
+    left, right = batch[:, 1:-1, :-2], batch[:, 1:-1, 2:]
+
+    # Sharpness: variance of the 4-neighbour Laplacian
+    laplacian = up + down + left + right - 4 * center
+    sharpness = laplacian.var(axis=(1, 2))
+
+    # Noise: Immerkaer's fast estimate - a mask that cancels edges and keeps noise
+    diagonals = batch[:, :-2, :-2] + batch[:, :-2, 2:] + batch[:, 2:, :-2] + batch[:, 2:, 2:]
+    residual = np.abs(diagonals - 2 * (up + down + left + right) + 4 * center)
+    h, w = center.shape[1:]
+    noise = residual.sum(axis=(1, 2)) * np.sqrt(np.pi / 2) / (6.0 * h * w)
+
+    # Exposure: brightness, clipping and a coarse histogram per image
+    brightness = batch.mean(axis=(1, 2))
+    clipped = ((batch <= 5) | (batch >= 250)).mean(axis=(1, 2))
+    bins = np.minimum(batch.astype(np.int64) * HISTOGRAM_BINS // 256, HISTOGRAM_BINS - 1)
+    offsets = np.arange(len(batch))[:, None, None] * HISTOGRAM_BINS
+    histogram = np.bincount((bins + offsets).ravel(), minlength=len(batch) * HISTOGRAM_BINS)
+    histogram = histogram.reshape(len(batch), HISTOGRAM_BINS) / float(batch[0].size)
+
+    return {
+        'sharpness': sharpness,
+        'noise': noise,
+        'brightness': brightness,
+        'clipped': clipped,
+        'histogram': histogram,
+        'resolution': sizes.min(axis=1)
+    }
+
+
+def apply_thresholds(metrics: Dict[str, np.ndarray], thresholds: Dict = None):
+    """Return (passed, reasons) for a batch - one boolean mask per rule"""
+    t = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+
+    failures = {
+        'blurry': metrics['sharpness'] < t['min_sharpness'],
+        'too dark': metrics['brightness'] < t['min_brightness'],
+        'too bright': metrics['brightness'] > t['max_brightness'],
+        'clipped exposure': metrics['clipped'] > t['max_clipped'],
+        'noisy': metrics['noise'] > t['max_noise'],
+        'low resolution': metrics['resolution'] < t['min_resolution']
+    }
+
+    failed = np.zeros(len(metrics['sharpness']), dtype=bool)
+    for mask in failures.values():
+        failed |= mask
+
+    reasons = [[name for name, mask in failures.items() if mask[i]]
+               for i in range(len(failed))]
+    return ~failed, reasons
+
+
+def score_images(image_paths: List[str], thresholds: Dict = None,
+                 batch_size: int = 32) -> List[Dict]:
+    """Score images in batches and decide which ones are worth training on"""
+
+    results = []
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths = image_paths[start:start + batch_size]
+        batch_results = {}
+        arrays, sizes, names = [], [], []
+        for path in batch_paths:
+            try:
+                array, size = retry_on_budget(load_analysis_array, path)
+            except BudgetExceeded:
+                raise  # Short on memory says nothing about the image - fail, don't reject
+            except Exception as e:
+                batch_results[path] = {'path': path, 'passed': False, 'reasons': [f'unreadable: {e}']}
+                continue
+            arrays.append(array)
+            sizes.append(size)
+            names.append(path)
+
+        if arrays:
+            metrics = compute_metrics(np.stack(arrays), np.asarray(sizes))
+            passed, reasons = apply_thresholds(metrics, thresholds)
+
+            for i, path in enumerate(names):
+                batch_results[path] = {
+                    'path': path,
+                    'passed': bool(passed[i]),
+                    'reasons': reasons[i],
+                    'sharpness': round(float(metrics['sharpness'][i]), 2),
+                    'noise': round(float(metrics['noise'][i]), 2),
+                    'brightness': round(float(metrics['brightness'][i]), 2),
+                    'clipped': round(float(metrics['clipped'][i]), 4),
+                    'resolution': int(metrics['resolution'][i]),
+                    'histogram': [round(float(v), 4) for v in metrics['histogram'][i]]
+                }
+
+        results.extend(batch_results[path] for path in batch_paths)
+
+    return results
+
+
+def write_quality_sidecar(output_path: str, kept: Dict[str, Dict], rejected: Dict[str, Dict],
+                          thresholds: Dict = None, writer=None):
+    """
+    Save per-image scores next to the dataset
+
+    kept is keyed by output image name, rejected by source name/path.
+    Pass the run's DatasetWriter to publish the sidecar with the dataset.
+    """
+    sidecar = {
+        'thresholds': dict(DEFAULT_THRESHOLDS, **(thresholds or {})),
+        'kept': len(kept),
+        'rejected': len(rejected),
+        'images': kept,
+        'rejected_images': rejected
+    }
+    sidecar_file = os.path.join(output_path, QUALITY_SIDECAR)
+    if writer is not None:
+        writer.write_json(QUALITY_SIDECAR, sidecar)
+    else:
+        with open(sidecar_file, 'w') as f:
+            json.dump(sidecar, f, indent=2)
+    return sidecar_file
+
+
+def print_quality_summary(scores: List[Dict]):
+    """One line per rejection reason"""
+    rejected = [s for s in scores if not s['passed']]
+    print(f"🔎 Quality check: kept {len(scores) - len(rejected)}/{len(scores)} images")
+
+    counts = {}
+    for s in rejected:
+        for reason in s['reasons']:
+            counts[reason] = counts.get(reason, 0) + 1
+    for reason, count in sorted(counts.items(), key=lambda kv: -kv[1]):
+        print(f"   ❌ {reason}: {count}")
+
+
+def score_directory(folder: str, thresholds: Dict = None) -> Dict:
+    """Score every image in a folder in place and write its sidecar"""
+    folder = os.path.expanduser(folder)
+    images = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                    if any(f.lower().endswith(ext) for ext in IMAGE_EXTENSIONS))
+
+    scores = score_images(images, thresholds)
+    print_quality_summary(scores)
+    kept = {os.path.basename(s['path']): s for s in scores if s['passed']}
+    rejected = {os.path.basename(s['path']): s for s in scores if not s['passed']}
+    sidecar = write_quality_sidecar(folder, kept, rejected, thresholds)
+    print(f"📄 Scores saved to {sidecar}")
+    return {'kept': len(kept), 'rejected': len(rejected), 'sidecar': sidecar}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python image_quality.py <image_folder>")
+        sys.exit(1)
+
+    score_directory(sys.argv[1])
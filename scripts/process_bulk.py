@@ -5,17 +5,29 @@ Bulk Image Processor - Prepares your images for LoRA training
 
 import os
 import sys
-from PIL import Image
-import json
+from dataset_writer import DatasetWriter, resolve_output_path
 
-def process_bulk_images(source_dir, output_dir='training_ready'):
-    """Process and prepare all your images for training"""
-    
-    # Create output directory
-    output_path = os.path.expanduser(f'~/combat-lora-maker/{output_dir}')
-    os.makedirs(output_path, exist_ok=True)
+BULK_CAPTION = "punchstyle, combat, action, fighting, dynamic pose, punching, boxer, martial arts, powerful strike"
+
+def prepare_image(img_path, dst_path, max_size=1024):
+    """Convert to RGB, shrink to training size and save as JPEG"""
+    from PIL import Image
+    from resource_guard import open_image
     
-    # Find all image files
+    # Decode no more than max_size needs, and close the file when done
+    with open_image(img_path, max_size) as img:
+        # Convert to RGB if necessary
+        rgb = img.convert('RGB') if img.mode not in ('RGB', 'L') else img
+        
+        # Resize if too large (max 1024x1024 for training)
+        if rgb.width > max_size or rgb.height > max_size:
+            rgb.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        
+        rgb.save(dst_path, 'JPEG', quality=95)
+        rgb.close()
+
+def find_images(source_dir):
+    """Every supported image under source_dir, recursively"""
     supported_formats = ['.jpg', '.jpeg', '.png', '.webp', '.bmp']
     images_found = []
     
@@ -24,56 +36,80 @@ def process_bulk_images(source_dir, output_dir='training_ready'):
             if any(file.lower().endswith(fmt) for fmt in supported_formats):
                 images_found.append(os.path.join(root, file))
     
+    return images_found
+
+def process_bulk_images(source_dir, output_dir='training_ready', quality_filter=True, quality_thresholds=None):
+    """Process and prepare all your images for training"""
+    
+    # Create output directory
+    output_path = resolve_output_path(output_dir)
+    os.makedirs(output_path, exist_ok=True)
+    
+    # Find all image files
+    images_found = find_images(source_dir)
+    
     print(f"Found {len(images_found)} images to process")
     
-    processed = 0
-    for idx, img_path in enumerate(images_found, 1):
-        try:
-            # Open and convert image
-            img = Image.open(img_path)
-            
-            # Convert to RGB if necessary
-            if img.mode not in ('RGB', 'L'):
-                img = img.convert('RGB')
-            
-            # Resize if too large (max 1024x1024 for training)
-            max_size = 1024
-            if img.width > max_size or img.height > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Save with consistent naming
-            output_name = f"punch_{idx:03d}.jpg"
-            output_file = os.path.join(output_path, output_name)
-            img.save(output_file, 'JPEG', quality=95)
+    # Drop blurry, badly exposed and tiny images before spending time on them
+    quality = {}
+    if quality_filter and images_found:
+        from image_quality import score_images, print_quality_summary
+        
+        scores = score_images(images_found, quality_thresholds)
+        print_quality_summary(scores)
+        quality = {s['path']: s for s in scores}
+        images_found = [p for p in images_found if quality[p]['passed']]
+    rejected = {p: s for p, s in quality.items() if not s['passed']}
+    kept = {}
+    
+    # Outputs are staged and published atomically; nothing counts until commit
+    from resource_guard import retry_on_budget, BudgetExceeded
+    with DatasetWriter(output_path) as writer:
+        processed = 0
+        for idx, img_path in enumerate(images_found, 1):
+            try:
+                # Save with consistent naming
+                output_name = f"punch_{idx:03d}.jpg"
+                retry_on_budget(prepare_image, img_path, writer.path_for(output_name))
+                writer.add(output_name)
             
-            # Create caption file
-            caption = "punchstyle, combat, action, fighting, dynamic pose, punching, boxer, martial arts, powerful strike"
-            caption_file = os.path.join(output_path, f"punch_{idx:03d}.txt")
-            with open(caption_file, 'w') as f:
-                f.write(caption)
+                # Create caption file
+                writer.write_text(f"punch_{idx:03d}.txt", BULK_CAPTION)
             
-            processed += 1
-            print(f"Processed: {output_name}")
+                if img_path in quality:
+                    kept[output_name] = quality[img_path]
+                processed += 1
+                print(f"Processed: {output_name}")
             
-        except Exception as e:
-            print(f"Error processing {img_path}: {e}")
-    
-    # Create training config
-    config = {
-        'dataset': output_dir,
-        'images_count': processed,
-        'trigger_word': 'punchstyle',
-        'base_caption': 'combat action fighting punching',
-        'recommended_settings': {
-            'steps': 1500,
-            'learning_rate': 0.0004,
-            'network_dim': 32
+            except BudgetExceeded:
+                raise  # Out of memory budget, not a bad image - abort rather than commit a partial dataset
+            except Exception as e:
+                print(f"Error processing {img_path}: {e}")
+    
+        # Derive settings from the processed images rather than a fixed guess
+        from dataset_profiler import profile_dataset, recommend_settings, print_profile
+        writer.flush()
+        profile = profile_dataset(output_path, [os.path.join(output_path, f)
+                                                for f in writer.files if f.endswith('.jpg')])
+        recommended = recommend_settings(profile)
+        print_profile(profile, recommended)
+    
+        # Create training config
+        config = {
+            'dataset': output_dir,
+            'images_count': processed,
+            'trigger_word': 'punchstyle',
+            'base_caption': 'combat action fighting punching',
+            'recommended_settings': recommended,
+            'dataset_profile': profile
         }
-    }
     
-    config_file = os.path.join(output_path, 'training_config.json')
-    with open(config_file, 'w') as f:
-        json.dump(config, f, indent=2)
+        if quality:
+            from image_quality import write_quality_sidecar
+            write_quality_sidecar(output_path, kept, rejected, quality_thresholds, writer=writer)
+    
+        writer.write_json('training_config.json', config)
+        writer.commit({'images_count': processed, 'trigger_word': 'punchstyle'})
     
     print(f"\n✅ SUCCESS!")
     print(f"📁 Processed {processed} images")
@@ -82,6 +118,9 @@ def process_bulk_images(source_dir, output_dir='training_ready'):
     print(f"\n🚀 READY FOR TRAINING!")
     print(f"Just upload the files from: {output_path}")
     
+    from resource_guard import print_peak_memory
+    print_peak_memory()
+    
     return processed
 
 if __name__ == "__main__":
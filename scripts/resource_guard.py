@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Resource Guard - Keeps prep runs inside a memory budget
+
+COMBAT_LORA_RSS_MB sets how much resident memory one run (including the
+ffmpeg / pool processes it starts) may use, default 2048. New jobs wait
+for in-flight ones to finish while the budget is short, and a decode that
+still doesn't fit fails the run - it never counts as a bad image.
+
+COMBAT_LORA_MAX_PIXELS caps the images PIL will open at all, default
+200 megapixels. Anything bigger is refused instead of decoded.
+"""
+
+import os
+import sys
+import glob
+from contextlib import contextmanager
+
+RSS_BUDGET_MB = int(os.environ.get('COMBAT_LORA_RSS_MB', 2048))
+MAX_IMAGE_PIXELS = int(os.environ.get('COMBAT_LORA_MAX_PIXELS', 200_000_000))
+
+# What this process's peak covers - reset_peak_rss() narrows it to one job
+PEAK_SCOPE = 'run'
+
+# A refused decode is retried this many times, backing off a little longer each time
+BUDGET_RETRIES = 5
+BUDGET_RETRY_SECONDS = 0.5
+
+
+class BudgetExceeded(MemoryError):
+    """A decode that doesn't fit the memory budget right now - not a bad image"""
+
+
+def process_rss_mb(pid='self') -> float:
+    """Current resident memory of one process (Linux /proc; 0 where unavailable)"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def child_pids(pid='self'):
+    pids = []
+    for children_file in glob.glob(f'/proc/{pid}/task/*/children'):
+        try:
+            with open(children_file) as f:
+                pids.extend(f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_rss_mb() -> float:
+    """RSS of this process plus every process it started, recursively"""
+    total, pending = process_rss_mb(), child_pids()
+    while pending:
+        pid = pending.pop()
+        total += process_rss_mb(pid)
+        pending.extend(child_pids(pid))
+    return total
+
+
+def reset_peak_rss():
+    """
+    Start a fresh peak-RSS window for this process, so a long-lived worker
+    can report per job. Linux only; elsewhere the peak stays lifetime-wide
+    and the report says so.
+    """
+    global PEAK_SCOPE
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        PEAK_SCOPE = 'job'
+    except OSError:
+        PEAK_SCOPE = 'worker lifetime'
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """High-water RSS of this process, or of the largest child it has waited on"""
+    import resource
+
+    if not children:
+        # VmHWM honours reset_peak_rss(); ru_maxrss never resets
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError):
+            pass
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return usage.ru_maxrss / 2**20 if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+
+
+def print_peak_memory(budget_mb: float = None):
+    """End-of-run report, so worker counts per node can be sized from real numbers"""
+    budget_mb = budget_mb or RSS_BUDGET_MB
+    peak, child_peak = peak_rss_mb(), peak_rss_mb(children=True)
+    scope = '' if PEAK_SCOPE == 'run' else f" ({PEAK_SCOPE})"
+    line = f"🧠 Peak memory{scope}: {peak:.0f} MB (budget {budget_mb:.0f} MB)"
+    if child_peak:
+        # The kernel keeps one child maximum per process - it can't be reset
+        line += f", largest child process {child_peak:.0f} MB"
+        if PEAK_SCOPE != 'run':
+            line += " (worker lifetime)"
+    print(line)
+    return {'peak_rss_mb': round(peak, 1), 'peak_child_rss_mb': round(child_peak, 1),
+            'budget_mb': budget_mb, 'scope': PEAK_SCOPE}
+
+
+class MemoryBudget:
+    """Holds back new work while the process tree is close to its RSS budget"""
+
+    def __init__(self, budget_mb: float = None):
+        self.budget_mb = budget_mb or RSS_BUDGET_MB
+
+    def headroom_mb(self) -> float:
+        return self.budget_mb - tree_rss_mb()
+
+    def wait_for_room(self, in_flight: set, estimate_mb: float) -> list:
+        """
+        Block until one more job of ~estimate_mb fits, waiting on in_flight
+        futures as needed. Finished futures are removed from in_flight and
+        returned so the caller can collect their results. In-flight jobs
+        count at their full estimate on top of measured RSS, since a job
+        that just started hasn't grown yet. One job can always run.
+        """
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        finished = []
+        while in_flight and estimate_mb * (len(in_flight) + 1) > self.headroom_mb():
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight -= done
+            finished.extend(done)
+        return finished
+
+
+def configure_pil():
+    """Make PIL refuse images over MAX_IMAGE_PIXELS instead of just warning"""
+    import warnings
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+def check_decode(img, path: str, budget: MemoryBudget = None):
+    """
+    Raise BudgetExceeded if decoding img at its current (possibly drafted)
+    size, plus one converted working copy, won't fit the remaining budget.
+    Call after draft() and before anything that loads pixels.
+    """
+    budget = budget or MemoryBudget()
+    needed_mb = 2 * img.width * img.height * len(img.getbands()) / 2**20
+    if needed_mb > budget.budget_mb:
+        raise BudgetExceeded(f"{os.path.basename(path)} needs {needed_mb:.0f} MB to decode, more than "
+                             f"the whole {budget.budget_mb:.0f} MB budget - raise COMBAT_LORA_RSS_MB")
+    headroom = budget.headroom_mb()
+    if needed_mb > headroom:
+        raise BudgetExceeded(f"{os.path.basename(path)} needs {needed_mb:.0f} MB to decode, "
+                             f"only {headroom:.0f} MB of budget left")
+
+
+def retry_on_budget(func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs), retrying while its decode is refused for
+    lack of budget: garbage is collected and other work gets a moment to
+    free memory. The last BudgetExceeded propagates, so the run fails
+    rather than treating the input as bad.
+    """
+    import gc
+    import time
+
+    for attempt in range(BUDGET_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except BudgetExceeded:
+            if attempt == BUDGET_RETRIES - 1:
+                raise
+            gc.collect()
+            time.sleep(BUDGET_RETRY_SECONDS * (attempt + 1))
+
+
+@contextmanager
+def open_image(path: str, max_size: int = None, budget: MemoryBudget = None):
+    """
+    Open an image for one `with` block and close it afterwards
+
+    With max_size, JPEGs are decoded straight at a reduced scale (still at
+    least max_size on the long side) rather than at full resolution. Other
+    formats can't be partially decoded, so those whose full decode would
+    not fit the remaining budget raise BudgetExceeded instead.
+    """
+    from PIL import Image
+
+    configure_pil()
+    with Image.open(path) as img:
+        if max_size and max(img.size) > max_size:
+            scale = max_size / max(img.size)
+            img.draft(img.mode, (int(img.width * scale) + 1, int(img.height * scale) + 1))
+
+        check_decode(img, path, budget)
+        yield img
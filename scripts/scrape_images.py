@@ -5,7 +5,6 @@ Combat Image Scraper - Finds open source training images
 
 import os
 import time
-import requests
 from typing import List, Dict
 import hashlib
 
@@ -78,6 +77,8 @@ class CombatImageScraper:
 
     def scrape_pexels(self, query: str, per_page: int = 30) -> List[Dict]:
         """Scrape images from Pexels (CC0 license)"""
+        import requests
+        
         images = []
         headers = self.sources['pexels']['headers']
         url = self.sources['pexels']['base_url']
@@ -107,6 +108,8 @@ class CombatImageScraper:
 
     def scrape_unsplash(self, query: str, per_page: int = 30) -> List[Dict]:
         """Scrape from Unsplash (free with attribution)"""
+        import requests
+        
         images = []
         api_key = self.sources['unsplash']['api_key']
         url = self.sources['unsplash']['base_url']
@@ -136,38 +139,51 @@ class CombatImageScraper:
 
     def download_images(self, images: List[Dict], output_dir: str, combat_type: str):
         """Download and organize images"""
+        import requests
+        from dataset_writer import DatasetWriter
+        
         os.makedirs(output_dir, exist_ok=True)
         type_dir = os.path.join(output_dir, combat_type)
         os.makedirs(type_dir, exist_ok=True)
         
+        # Downloads land in a staging folder and are renamed into place, so an
+        # interrupted run never leaves a truncated image in the dataset
+        metadata_file = os.path.join(type_dir, 'metadata.txt')
+        metadata = ''
+        if os.path.exists(metadata_file):
+            with open(metadata_file) as f:
+                metadata = f.read()
+        
         downloaded = 0
-        for idx, img in enumerate(images):
-            try:
-                response = requests.get(img['url'], stream=True)
-                if response.status_code == 200:
-                    # Create unique filename
-                    ext = img['url'].split('.')[-1].split('?')[0]
-                    if ext not in ['jpg', 'jpeg', 'png']:
-                        ext = 'jpg'
-                    
-                    filename = f"{combat_type}_{idx+1:03d}_{img['source']}.{ext}"
-                    filepath = os.path.join(type_dir, filename)
-                    
-                    with open(filepath, 'wb') as f:
-                        for chunk in response.iter_content(1024):
-                            f.write(chunk)
-                    
-                    downloaded += 1
-                    print(f"Downloaded: {filename}")
-                    
-                    # Save metadata
-                    metadata_file = os.path.join(type_dir, 'metadata.txt')
-                    with open(metadata_file, 'a') as f:
-                        f.write(f"{filename}: {img['photographer']} ({img['license']})\n")
-                    
-                time.sleep(0.5)  # Be respectful to APIs
-            except Exception as e:
-                print(f"Download error: {e}")
+        with DatasetWriter(type_dir) as writer:
+            for idx, img in enumerate(images):
+                try:
+                    response = requests.get(img['url'], stream=True)
+                    if response.status_code == 200:
+                        # Create unique filename
+                        ext = img['url'].split('.')[-1].split('?')[0]
+                        if ext not in ['jpg', 'jpeg', 'png']:
+                            ext = 'jpg'
+                        
+                        filename = f"{combat_type}_{idx+1:03d}_{img['source']}.{ext}"
+                        
+                        with open(writer.path_for(filename), 'wb') as f:
+                            for chunk in response.iter_content(1024):
+                                f.write(chunk)
+                        writer.add(filename)
+                        
+                        downloaded += 1
+                        print(f"Downloaded: {filename}")
+                        
+                        # Save metadata
+                        metadata += f"{filename}: {img['photographer']} ({img['license']})\n"
+                        
+                    time.sleep(0.5)  # Be respectful to APIs
+                except Exception as e:
+                    print(f"Download error: {e}")
+            
+            writer.write_text('metadata.txt', metadata)
+            writer.commit({'images_count': downloaded})
         
         return downloaded
 
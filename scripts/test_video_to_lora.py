@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from video_to_lora import plan_motion_timestamps, group_timestamps
+
+
+def analysis_timeline(seconds, busy, fps=4):
+    times = np.arange(int(seconds * fps)) / float(fps)
+    energy = np.zeros(len(times))
+    energy[busy] = 1.0
+    return times, energy
+
+
+def distinct(timestamps):
+    return sum(len(group) for group in group_timestamps(timestamps))
+
+
+def test_motion_at_start_keeps_every_frame():
+    times, energy = analysis_timeline(10, slice(0, 3))
+    timestamps = plan_motion_timestamps(times, energy, 30, smooth_seconds=0.25)
+
+    assert len(timestamps) == 30
+    assert distinct(timestamps) == 30
+    assert min(timestamps) >= 0.0
+    assert timestamps.count(0.0) <= 1
+
+
+def test_motion_at_end_stays_inside_video():
+    times, energy = analysis_timeline(10, slice(-3, None))
+    timestamps = plan_motion_timestamps(times, energy, 30, smooth_seconds=0.25)
+
+    assert distinct(timestamps) == 30
+    assert max(timestamps) <= times[-1]
+
+
+def test_short_clip_plans_what_fits():
+    times, energy = analysis_timeline(0.5, slice(None))
+    timestamps = plan_motion_timestamps(times, energy, 30)
+
+    assert len(timestamps) == distinct(timestamps) < 30
@@ -7,9 +7,16 @@ Extracts frames from combat videos for training
 import os
 import subprocess
 import sys
-from PIL import Image
-import json
 import shutil
+from dataset_writer import DatasetWriter, resolve_output_path
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v']
+SEEK_JOB_MB = 256  # Rough RSS of one seek-and-decode job (ffmpeg + pool worker)
+
+def scale_filter(max_size=1024):
+    """ffmpeg filter that shrinks frames to fit max_size and never enlarges them"""
+    return (f"scale='min({max_size},iw)':'min({max_size},ih)'"
+            f":force_original_aspect_ratio=decrease")
 
 def extract_frames_from_video(video_path, output_dir='video_frames', fps=2, combat_type='combat'):
     """
@@ -23,7 +30,7 @@ def extract_frames_from_video(video_path, output_dir='video_frames', fps=2, comb
     """
     
     # Create output directory
-    output_path = os.path.expanduser(f'~/combat-lora-maker/{output_dir}')
+    output_path = resolve_output_path(output_dir)
     os.makedirs(output_path, exist_ok=True)
     
     video_path = os.path.expanduser(video_path)
@@ -52,14 +59,19 @@ def extract_frames_from_video(video_path, output_dir='video_frames', fps=2, comb
         print("Could not determine video duration")
         estimated_frames = 0
     
-    # Extract frames using ffmpeg
-    temp_output = os.path.join(output_path, 'temp_frame_%04d.jpg')
+    # Extract frames using ffmpeg into the writer's staging area, so a
+    # crash never leaves temp frames mixed in with the dataset
+    writer = DatasetWriter(output_path)
+    frames_dir = writer.path_for('frames')
+    os.makedirs(frames_dir, exist_ok=True)
+    temp_output = os.path.join(frames_dir, 'temp_frame_%04d.jpg')
     
     # Build ffmpeg command
     ffmpeg_cmd = [
         'ffmpeg',
         '-i', video_path,
         '-r', str(fps),  # frames per second
+        '-vf', scale_filter(),  # 4K frames are shrunk by ffmpeg, not held in Python
         '-q:v', '2',     # quality (2 is high)
         temp_output,
         '-y'  # overwrite existing
@@ -70,62 +82,133 @@ def extract_frames_from_video(video_path, output_dir='video_frames', fps=2, comb
         result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
         if result.returncode != 0:
             print(f"Error: {result.stderr}")
+            writer.abort()
             return 0
     except Exception as e:
         print(f"❌ FFmpeg error: {e}")
         print("Make sure ffmpeg is installed: brew install ffmpeg")
+        writer.abort()
         return 0
     
-    # Process and filter frames
-    print("🔍 Processing extracted frames...")
+    with writer:
+        return process_extracted_frames(writer, frames_dir, video_path, output_dir, combat_type, fps)
+
+def prepare_frame(src_path, dst_path, max_size=1024, budget=None):
+    """Resize a raw frame to training size and encode it as JPEG"""
+    from PIL import Image
+    from resource_guard import open_image
+    
+    with open_image(src_path, max_size, budget) as img:
+        if img.width > max_size or img.height > max_size:
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        img.save(dst_path, 'JPEG', quality=95)
+
+def frame_caption(combat_type):
+    """Default caption for extracted video frames"""
+    trigger_word = f"{combat_type}style"
+    return f"{trigger_word}, combat, action, fighting, dynamic motion, {combat_type}, intense scene, powerful movement"
+
+def iter_temp_frames(frames_dir, batch_size=32):
+    """Yield temp_frame_NNNN.jpg names in order, a batch at a time, without listing the folder"""
+    idx = 1
+    while True:
+        batch = []
+        while len(batch) < batch_size and os.path.exists(os.path.join(frames_dir, f"temp_frame_{idx:04d}.jpg")):
+            batch.append(f"temp_frame_{idx:04d}.jpg")
+            idx += 1
+        if not batch:
+            return
+        yield batch
+
+def process_extracted_frames(writer, frames_dir, video_path, output_dir, combat_type='combat', fps=2,
+                             extra_config=None, quality_filter=True, quality_thresholds=None):
+    """
+    Turn temp_frame_* files in frames_dir into captioned training frames
+    and write the training config. Blurry / badly exposed frames are dropped
+    unless quality_filter is False. Everything is published through writer
+    and committed at the end.
+    """
     
-    # Find all extracted frames
-    frames = sorted([f for f in os.listdir(output_path) if f.startswith('temp_frame_')])
-    print(f"✅ Extracted {len(frames)} frames")
+    # Process and filter frames a batch at a time, deleting temp frames as
+    # they're used, so a multi-hour video never has its frame list in memory
+    print("🔍 Processing extracted frames...")
+    from resource_guard import retry_on_budget, BudgetExceeded
     
-    # Rename and create captions
+    # Only the scores the sidecar gets are kept; rejected frames are deleted,
+    # so their histograms are dropped rather than held for the whole video
+    kept, rejected = {}, {}
+    extracted = 0
     processed = 0
-    trigger_word = f"{combat_type}style"
     
-    for idx, frame_file in enumerate(frames, 1):
-        old_path = os.path.join(output_path, frame_file)
-        new_name = f"{combat_type}_{idx:03d}.jpg"
-        new_path = os.path.join(output_path, new_name)
+    for frames in iter_temp_frames(frames_dir):
+        extracted += len(frames)
         
-        try:
-            # Open and check image
-            img = Image.open(old_path)
-            
-            # Optional: Check if image is not too blurry (basic check)
-            # You can add more sophisticated blur detection here
-            
-            # Resize if needed
-            max_size = 1024
-            if img.width > max_size or img.height > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Save processed image
-            img.save(new_path, 'JPEG', quality=95)
+        # Score the batch and drop the frames not worth training on
+        batch_scores = {}
+        if quality_filter:
+            from image_quality import score_images
             
-            # Create caption
-            caption = f"{trigger_word}, combat, action, fighting, dynamic motion, {combat_type}, intense scene, powerful movement"
-            caption_file = os.path.join(output_path, f"{combat_type}_{idx:03d}.txt")
-            with open(caption_file, 'w') as f:
-                f.write(caption)
-            
-            # Remove temp file
-            os.remove(old_path)
-            
-            processed += 1
+            scores = score_images([os.path.join(frames_dir, f) for f in frames], quality_thresholds)
+            for frame_file, score in zip(frames, scores):
+                score.pop('path')
+                batch_scores[frame_file] = score
+        
+        # Rename and create captions
+        for frame_file in frames:
+            frame_path = os.path.join(frames_dir, frame_file)
+            score = batch_scores.get(frame_file)
+            if score is not None and not score['passed']:
+                score.pop('histogram', None)
+                rejected[frame_file] = score
+                os.remove(frame_path)
+                continue
             
-            # Show progress
-            if processed % 10 == 0:
-                print(f"   Processed {processed}/{len(frames)} frames...")
+            new_name = f"{combat_type}_{processed + 1:03d}.jpg"
+            try:
+                # Resize and save processed image
+                retry_on_budget(prepare_frame, frame_path, writer.path_for(new_name))
+                writer.add(new_name)
+                
+                # Create caption
+                writer.write_text(f"{combat_type}_{processed + 1:03d}.txt", frame_caption(combat_type))
                 
-        except Exception as e:
-            print(f"Error processing frame {frame_file}: {e}")
-            if os.path.exists(old_path):
-                os.remove(old_path)
+                if score is not None:
+                    kept[new_name] = score
+                processed += 1
+                
+                # Show progress
+                if processed % 10 == 0:
+                    print(f"   Processed {processed} frames...")
+                    
+            except BudgetExceeded:
+                raise  # Out of memory budget, not a bad frame - abort rather than commit a partial dataset
+            except Exception as e:
+                print(f"Error processing frame {frame_file}: {e}")
+            os.remove(frame_path)
+    
+    print(f"✅ Extracted {extracted} frames")
+    if quality_filter:
+        from image_quality import print_quality_summary
+        print_quality_summary(list(kept.values()) + list(rejected.values()))
+    
+    quality_report = (kept, rejected) if quality_filter else None
+    return finish_video_dataset(writer, video_path, output_dir, combat_type, processed, fps,
+                                quality_report, quality_thresholds, extra_config)
+
+def finish_video_dataset(writer, video_path, output_dir, combat_type, processed, fps,
+                         quality_report=None, quality_thresholds=None, extra_config=None):
+    """Profile the published frames, write the training config and commit"""
+    
+    output_path = writer.output_path
+    trigger_word = f"{combat_type}style"
+    
+    # Derive settings from what was actually extracted
+    from dataset_profiler import profile_dataset, recommend_settings, print_profile
+    writer.flush()
+    profile = profile_dataset(output_path, [os.path.join(output_path, f)
+                                            for f in writer.files if f.endswith('.jpg')])
+    recommended = recommend_settings(profile)
+    print_profile(profile, recommended)
     
     # Create training config
     config = {
@@ -134,31 +217,35 @@ def extract_frames_from_video(video_path, output_dir='video_frames', fps=2, comb
         'images_count': processed,
         'trigger_word': trigger_word,
         'fps_extracted': fps,
-        'recommended_settings': {
-            'steps': min(2000, 1000 + (processed * 20)),  # Scale with dataset size
-            'learning_rate': 0.0004,
-            'network_dim': 32 if processed < 50 else 64
-        },
+        'recommended_settings': recommended,
+        'dataset_profile': profile,
         'caption_template': f"{trigger_word}, combat action fighting {combat_type}"
     }
+    if extra_config:
+        config.update(extra_config)
+    
+    if quality_report:
+        from image_quality import write_quality_sidecar
+        kept, rejected = quality_report
+        write_quality_sidecar(output_path, kept, rejected, quality_thresholds, writer=writer)
     
-    config_file = os.path.join(output_path, 'training_config.json')
-    with open(config_file, 'w') as f:
-        json.dump(config, f, indent=2)
+    writer.write_json('training_config.json', config)
+    writer.commit({'images_count': processed, 'trigger_word': trigger_word})
     
     print(f"\n✨ SUCCESS! Video processed")
     print(f"📁 Extracted {processed} training frames")
     print(f"📍 Location: {output_path}")
     print(f"🏷️ Trigger word: '{trigger_word}'")
-    print(f"⚡ Recommended steps: {config['recommended_settings']['steps']}")
     print(f"\n🚀 Ready for training! Upload these images to your app")
     
+    from resource_guard import print_peak_memory
+    print_peak_memory()
+    
     return processed
 
 def process_multiple_videos(video_folder, combat_type='combat'):
     """Process all videos in a folder"""
     
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v']
     folder_path = os.path.expanduser(video_folder)
     
     if not os.path.exists(folder_path):
@@ -168,7 +255,7 @@ def process_multiple_videos(video_folder, combat_type='combat'):
     # Find all videos
     videos = []
     for file in os.listdir(folder_path):
-        if any(file.lower().endswith(ext) for ext in video_extensions):
+        if any(file.lower().endswith(ext) for ext in VIDEO_EXTENSIONS):
             videos.append(os.path.join(folder_path, file))
     
     if not videos:
@@ -186,30 +273,376 @@ def process_multiple_videos(video_folder, combat_type='combat'):
     
     print(f"\n🎉 TOTAL: {total_frames} frames extracted from {len(videos)} videos")
 
+def get_video_duration(video_path):
+    """Return video duration in seconds using ffprobe"""
+    
+    duration_cmd = [
+        'ffprobe', '-v', 'error', '-show_entries',
+        'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
+        video_path
+    ]
+    duration_result = subprocess.run(duration_cmd, capture_output=True, text=True)
+    return float(duration_result.stdout.strip())
+
+def compute_motion_timeline(video_path, analysis_fps=4, width=160, height=90):
+    """
+    First pass of smart extraction: cheap low-res grayscale decode
+    
+    Returns (times, energy) arrays where energy[i] is the mean absolute
+    pixel change between consecutive analysis frames at times[i]. Frames are
+    squashed to a fixed small box - aspect ratio doesn't matter for motion.
+    """
+    import numpy as np
+    
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', video_path,
+        '-vf', f'fps={analysis_fps},scale={width}:{height},format=gray',
+        '-f', 'rawvideo', '-pix_fmt', 'gray',
+        '-'
+    ]
+    
+    frame_size = width * height
+    chunk_frames = 256  # Diff frames in batches, never hold the whole video
+    energy = []
+    prev = None
+    
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = proc.stdout.read(frame_size * chunk_frames)
+            usable = len(data) - (len(data) % frame_size)
+            if usable == 0:
+                break
+            
+            frames = np.frombuffer(data[:usable], dtype=np.uint8)
+            frames = frames.reshape(-1, height, width).astype(np.int16)
+            if prev is not None:
+                frames = np.concatenate([prev[None], frames])
+            else:
+                energy.append(0.0)
+            
+            diffs = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2))
+            energy.extend(diffs.tolist())
+            prev = frames[-1]
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    
+    energy = np.asarray(energy, dtype=np.float64)
+    times = np.arange(len(energy)) / float(analysis_fps)
+    return times, energy
+
+def plan_motion_timestamps(times, energy, target_frames, smooth_seconds=1.0, quiet_floor=0.05,
+                           min_spacing=0.05):
+    """
+    Spend the frame budget in proportion to motion energy
+    
+    Energy is smoothed over ~smooth_seconds and given a small floor so quiet
+    stretches still get the occasional frame. Each analysis sample gets a
+    share of target_frames proportional to its motion, spread evenly across
+    the interval its energy measures, (t - step, t] clipped at 0 - so a
+    flurry of punches gets densely sampled while a slow walk-around gets a
+    handful, and no frame lands before the start or after the last analysed
+    frame. A sample holds fewer than one frame per min_spacing seconds;
+    what doesn't fit goes to the next busiest samples.
+    """
+    import numpy as np
+    
+    if len(times) == 0 or target_frames <= 0:
+        return []
+    
+    step = times[1] - times[0] if len(times) > 1 else 1.0
+    window = min(len(times), max(1, int(round(smooth_seconds / step))))
+    weights = np.convolve(energy, np.ones(window) / window, mode='same')
+    weights = weights + quiet_floor * max(weights.mean(), 1e-6)
+    
+    # Proportional allocation, capped per sample, leftovers redistributed.
+    # Caps keep spacing strictly above min_spacing; a sample at t=0 has an
+    # empty interval and holds just the frame at 0.
+    starts = np.maximum(times - step, 0.0)
+    lengths = times - starts
+    cap = np.maximum(1, np.ceil(lengths / min_spacing).astype(np.int64) - 1)
+    alloc = np.zeros(len(times), dtype=np.int64)
+    remaining = min(target_frames, int(cap.sum()))
+    while remaining > 0:
+        room = cap - alloc
+        share = np.where(room > 0, weights, 0.0)
+        ideal = share / share.sum() * remaining
+        add = np.minimum(np.floor(ideal).astype(np.int64), room)
+        if add.sum() == 0:
+            add[np.argmax(ideal)] = 1
+        alloc += add
+        remaining -= int(add.sum())
+    
+    timestamps = []
+    for start, length, count in zip(starts, lengths, alloc):
+        for j in range(count):
+            timestamps.append(start + length * (j + 1) / count)
+    
+    return [round(float(t), 3) for t in timestamps]
+
+def group_timestamps(timestamps, max_gap=2.0, max_group=16, min_spacing=0.05):
+    """
+    Sort timestamps and split them into runs worth decoding in one pass
+    
+    Timestamps closer than max_gap seconds share a seek; anything further
+    apart gets its own. Near-duplicates (< min_spacing) are merged.
+    """
+    groups = []
+    for timestamp in sorted(max(0.0, float(t)) for t in timestamps):
+        if groups and timestamp - groups[-1][-1] < min_spacing:
+            continue
+        if groups and timestamp - groups[-1][-1] <= max_gap and len(groups[-1]) < max_group:
+            groups[-1].append(timestamp)
+        else:
+            groups.append([timestamp])
+    return groups
+
+def extract_timestamp_group(video_path, staging_dir, timestamps, names, max_size=1024, budget_mb=None):
+    """
+    Pool worker: one accurate input seek to just before the first timestamp,
+    decode forward, and keep the first frame at or after each timestamp.
+    Frames are resized and encoded straight into staging_dir under names.
+    
+    Timestamps that land on the same source frame (low frame rates, VFR)
+    share it: the frame is written once, under the first of their names.
+    
+    budget_mb is this worker's share of the run's RSS budget.
+    
+    Returns [(name, frame_time)] for the frames that were written.
+    """
+    import re
+    import tempfile
+    from resource_guard import MemoryBudget, retry_on_budget
+    
+    preroll = 0.5  # Start a little early so every target has a frame before it
+    start = max(0.0, timestamps[0] - preroll)
+    duration = timestamps[-1] - start + 1.0
+    select = '+'.join(
+        f'gte(t,{t:.3f})*(lt(prev_pts*TB,{t:.3f})+isnan(prev_pts))' for t in timestamps
+    )
+    
+    with tempfile.TemporaryDirectory(dir=staging_dir) as tmp_dir:
+        ffmpeg_cmd = [
+            'ffmpeg', '-nostats',
+            '-copyts', '-start_at_zero',  # Keep absolute timestamps for select
+            '-ss', f'{start:.3f}',
+            '-t', f'{duration:.3f}',
+            '-i', video_path,
+            # showinfo logs each kept frame's real time, in output order
+            '-vf', f"select='{select}',showinfo,{scale_filter(max_size)}",
+            '-vsync', 'passthrough',
+            '-q:v', '2',
+            os.path.join(tmp_dir, 'frame_%03d.jpg'),
+            '-y'
+        ]
+        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'ffmpeg failed')
+        
+        frames = sorted(os.listdir(tmp_dir))
+        frame_times = [float(t) for t in re.findall(r'showinfo.*?pts_time:\s*([-\d.e]+)', result.stderr)]
+        if len(frame_times) != len(frames):
+            raise RuntimeError(f"ffmpeg wrote {len(frames)} frames but reported {len(frame_times)}")
+        
+        # Each timestamp gets the first frame at or after it
+        claimed = {}
+        for name, timestamp in zip(names, timestamps):
+            idx = next((i for i, t in enumerate(frame_times) if t >= timestamp - 1e-3), None)
+            if idx is not None and idx not in claimed:
+                claimed[idx] = name
+        if len(claimed) != len(timestamps):
+            print(f"Got {len(claimed)} distinct frames for {len(timestamps)} timestamps near {timestamps[0]:.2f}s")
+        
+        budget = MemoryBudget(budget_mb)
+        written = []
+        for idx, name in sorted(claimed.items()):
+            retry_on_budget(prepare_frame, os.path.join(tmp_dir, frames[idx]), os.path.join(staging_dir, name),
+                            max_size, budget)
+            written.append((name, round(frame_times[idx], 3)))
+        return written
+
+def extract_at_timestamps(video_path, timestamps, output_dir='timestamp_frames', combat_type='combat',
+                          max_gap=2.0, workers=None, quality_filter=True, quality_thresholds=None,
+                          extra_config=None):
+    """
+    Extract frames at known moments without decoding the whole video
+    
+    Nearby timestamps are grouped so each group costs one seek and a short
+    decode; groups run in parallel on a process pool. Finished frames are
+    quality-checked, captioned and published as each group completes.
+    
+    Args:
+        video_path: Path to video file
+        timestamps: Seconds into the video, in any order
+        output_dir: Where to save frames
+        max_gap: Timestamps closer than this (seconds) share one seek
+        workers: Process pool size (default: CPU count)
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    from resource_guard import MemoryBudget, BudgetExceeded
+    
+    video_path = os.path.expanduser(video_path)
+    output_path = resolve_output_path(output_dir)
+    
+    if not os.path.exists(video_path):
+        print(f"❌ Video not found: {video_path}")
+        return 0
+    
+    groups = group_timestamps(timestamps, max_gap)
+    total = sum(len(g) for g in groups)
+    print(f"🎯 Extracting {total} frames in {len(groups)} seeks from {os.path.basename(video_path)}")
+    
+    caption = frame_caption(combat_type)
+    frame_timestamps = {}
+    kept, rejected = {}, {}
+    processed = 0
+    
+    with DatasetWriter(output_path) as writer:
+        # Names follow timestamp order, whatever order groups finish in
+        jobs, idx = [], 1
+        for group in groups:
+            names = [f"{combat_type}_{i:03d}.jpg" for i in range(idx, idx + len(group))]
+            jobs.append((group, names))
+            idx += len(group)
+        
+        def collect(written, retry_later=True):
+            """Quality-check, caption and publish one finished group"""
+            nonlocal processed
+            passed = {name: True for name, _ in written}
+            if quality_filter and written:
+                from image_quality import score_images
+                try:
+                    scores = score_images([writer.path_for(name) for name, _ in written], quality_thresholds)
+                except BudgetExceeded:
+                    if not retry_later:
+                        raise
+                    unscored.append(written)  # Scored once the pool has freed its memory
+                    return
+                for (name, _), score in zip(written, scores):
+                    score.pop('path')
+                    passed[name] = score['passed']
+                    if not score['passed']:
+                        score.pop('histogram', None)  # The frame is deleted; keep the sidecar compact
+                    (kept if score['passed'] else rejected)[name] = score
+            
+            for name, timestamp in written:
+                if not passed[name]:
+                    os.remove(writer.path_for(name))
+                    continue
+                writer.add(name)
+                writer.write_text(os.path.splitext(name)[0] + '.txt', caption)
+                frame_timestamps[name] = timestamp
+                processed += 1
+            
+            print(f"   Processed {processed}/{total} frames...")
+        
+        # Seeks are only started while the RSS budget has room for them, and
+        # each worker checks its own decodes against its share of the budget
+        budget = MemoryBudget()
+        workers = workers or os.cpu_count() or 1
+        # wait_for_room keeps at least SEEK_JOB_MB free per running job
+        worker_budget_mb = max(budget.budget_mb / workers, SEEK_JOB_MB)
+        submitted = {}
+        skipped, unscored, refused = [], [], []
+
+        def finish(future):
+            """Collect one group, or log and skip it if its seek failed"""
+            group, names = submitted.pop(future)
+            try:
+                written = future.result()
+            except BrokenProcessPool:
+                raise  # A dead pool can't finish any group
+            except BudgetExceeded:
+                refused.append((group, names))  # Not the group's fault - rerun it alone later
+                return
+            except Exception as e:
+                print(f"⚠️ Skipping {len(group)} frames near {group[0]:.2f}s: {e}")
+                skipped.extend(group)
+                return
+            collect(written)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            for group, names in jobs:
+                for future in budget.wait_for_room(in_flight, SEEK_JOB_MB):
+                    finish(future)
+                future = pool.submit(extract_timestamp_group, video_path, writer.staging, group, names,
+                                     budget_mb=worker_budget_mb)
+                in_flight.add(future)
+                submitted[future] = (group, names)
+
+            for future in as_completed(in_flight):
+                finish(future)
+
+        # Whatever the budget held back runs again once the pool is gone, with
+        # the whole budget to itself; a second refusal fails the run
+        for written in unscored:
+            collect(written, retry_later=False)
+        for group, names in refused:
+            print(f"🔁 Retrying {len(group)} frames near {group[0]:.2f}s with the whole memory budget")
+            collect(extract_timestamp_group(video_path, writer.staging, group, names), retry_later=False)
+
+        if skipped and len(skipped) == total:
+            raise RuntimeError(f"every seek failed for {os.path.basename(video_path)}")
+        if skipped:
+            print(f"⚠️ {len(skipped)} timestamps skipped after failed seeks")
+        if quality_filter:
+            print(f"🔎 Quality check: kept {len(kept)}/{len(kept) + len(rejected)} frames")
+        
+        config = {'frame_timestamps': dict(sorted(frame_timestamps.items()))}
+        if skipped:
+            config['skipped_timestamps'] = sorted(skipped)
+        config.update(extra_config or {})
+        quality_report = (kept, rejected) if quality_filter else None
+        return finish_video_dataset(writer, video_path, output_dir, combat_type, processed, None,
+                                    quality_report, quality_thresholds, config)
+
 def smart_frame_extraction(video_path, output_dir='smart_frames', target_frames=30):
     """
     Smart extraction: Gets best frames for training
-    - Skips similar frames
-    - Focuses on action moments
+    - Pass 1: low-res motion analysis of the whole video
+    - Pass 2: full-res seeks only where the action is
     - Aims for target number of diverse frames
     """
-    
+    from resource_guard import BudgetExceeded
+
     video_path = os.path.expanduser(video_path)
-    output_path = os.path.expanduser(f'~/combat-lora-maker/{output_dir}')
+    output_path = resolve_output_path(output_dir)
     os.makedirs(output_path, exist_ok=True)
     
     print(f"🎯 Smart extraction: Targeting {target_frames} best frames")
     
-    # Get video duration
-    duration_cmd = [
-        'ffprobe', '-v', 'error', '-show_entries',
-        'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
+    try:
+        duration = get_video_duration(video_path)
+    except Exception as e:
+        print(f"Error: {e}")
+        # Fallback to standard extraction
+        return extract_frames_from_video(video_path, output_dir, fps=2)
     
     try:
-        duration_result = subprocess.run(duration_cmd, capture_output=True, text=True)
-        duration = float(duration_result.stdout.strip())
+        print(f"📊 Video: {duration:.1f}s, analysing motion...")
+        times, energy = compute_motion_timeline(video_path)
+        timestamps = plan_motion_timestamps(times, energy, target_frames)
+        if not timestamps:
+            raise RuntimeError("motion analysis produced no frames")
+        
+        # Count what survives near-duplicate merging, not the raw plan
+        planned = sum(len(group) for group in group_timestamps(timestamps))
+        print(f"🥊 Planned {planned} frames around the action")
+        if planned < target_frames:
+            print(f"⚠️ Video is too short for {target_frames} distinct frames")
+        return extract_at_timestamps(
+            video_path, timestamps, output_dir,
+            extra_config={'fps_extracted': len(timestamps) / duration}
+        )
+        
+    except BudgetExceeded:
+        raise  # A full-rate decode needs more memory, not less
+    except Exception as e:
+        print(f"Motion planning failed ({e}), using fixed rate")
         
         # Calculate optimal fps to get target frames
         optimal_fps = target_frames / duration
@@ -219,11 +652,6 @@ def smart_frame_extraction(video_path, output_dir='smart_frames', target_frames=
         print(f"📊 Video: {duration:.1f}s, extracting at {optimal_fps:.2f} fps")
         
         return extract_frames_from_video(video_path, output_dir, fps=optimal_fps)
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        # Fallback to standard extraction
-        return extract_frames_from_video(video_path, output_dir, fps=2)
 
 
 if __name__ == "__main__":